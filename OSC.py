@@ -44,6 +44,10 @@ import math
 import string
 import time
 
+_int32 = struct.Struct(">i")
+_float32 = struct.Struct(">f")
+_timetag = struct.Struct(">ll")
+
 def hexDump(bytes):
     """Useful utility; prints the string in hexadecimal"""
     for i in range(len(bytes)):
@@ -90,9 +94,7 @@ class OSCMessage:
 
     def getBinary(self):
         """Returns the binary message (so far) with typetags."""
-        address  = OSCArgument(self.address)[1]
-        typetags = OSCArgument(self.typetags)[1]
-        return address + typetags + self.message
+        return _header(self.address, self.typetags) + self.message
 
     def __repr__(self):
         return self.getBinary()
@@ -128,11 +130,48 @@ class OSCBundle:
             raise Exception('invalid type of first argument to OSCBundle.append(), need address string or OSCMessage, not ', str(type(address)))
 
     def getBinary(self):
-        retval = OSCArgument('#bundle')[1] + abs_to_timestamp(self.when)
-        for item in self.items:
-            binary = item.getBinary()
-            retval = retval + OSCArgument(len(binary))[1] + binary
-        return retval
+        return bundleBinaries([item.getBinary() for item in self.items], self.when)
+
+def bundleBinaries(binaries, when=None):
+    """Wraps encoded messages in a bundle."""
+    if when == None:
+        when = time.time()
+    parts = [_padString('#bundle'), abs_to_timestamp(when)]
+    for binary in binaries:
+        parts.append(_int32.pack(len(binary)))
+        parts.append(binary)
+    return "".join(parts)
+
+def groupForBundles(binaries, max_size):
+    """Splits encoded messages, in order, into as few groups as
+    possible, each fitting in a bundle of at most max_size bytes.
+    A message too large for a bundle is alone in its group."""
+    groups = []
+    group = []
+    size = 16
+    for binary in binaries:
+        if group and size + 4 + len(binary) > max_size:
+            groups.append(group)
+            group = []
+            size = 16
+        group.append(binary)
+        size += 4 + len(binary)
+
+    if group:
+        groups.append(group)
+    return groups
+
+def packBundles(binaries, max_size, when=None):
+    """Packs encoded messages, in order, into as few bundles of
+    at most max_size bytes as possible. A bundle holding a single
+    message is replaced by the message itself, as is a message
+    too large to fit in a bundle on its own."""
+    if when == None:
+        when = time.time()
+    packets = []
+    for group in groupForBundles(binaries, max_size):
+        packets.append(group[0] if len(group) == 1 else bundleBinaries(group, when))
+    return packets
 
 def readString(data):
     length   = string.find(data,"\0")
@@ -198,23 +237,112 @@ def OSCArgument(next):
         if (type(next) == type(unicode())):
             next = str(next)
         
-        OSCstringLength = math.ceil((len(next)+1) / 4.0) * 4
-        binary  = struct.pack(">%ds" % (OSCstringLength), next)
+        binary  = _padString(next)
         tag = "s"
     elif type(next) == type(False):
-        binary  = struct.pack(">i", int(next))
+        binary  = _int32.pack(int(next))
         tag = "i"
     elif type(next) == type(42.5):
-        binary  = struct.pack(">f", next)
+        binary  = _float32.pack(next)
         tag = "f"
     elif type(next) == type(13):
-        binary  = struct.pack(">i", next)
+        binary  = _int32.pack(next)
         tag = "i"
     else:
         raise Exception("don't know how to encode " + str(next) + " as OSC argument, type=" + str(type(next)))
 
     return (tag, binary)
 
+_padding = ("\0\0\0\0", "\0\0\0", "\0\0", "\0")
+_blob_padding = ("", "\0\0\0", "\0\0", "\0")
+_max_cached = 4096
+_headers = {}
+_plans = {}
+
+class Blob(str):
+    """A string encoded as an OSC blob by encodeOSC."""
+    pass
+
+def _padString(value):
+    """Null terminates a string and pads it to a multiple of 4 bytes."""
+    return value + _padding[len(value) & 3]
+
+def _header(address, typetags):
+    """Returns the padded address and typetags, encoded once per pair."""
+    key = (address, typetags)
+    header = _headers.get(key)
+    if header is None:
+        if len(_headers) > _max_cached:
+            _headers.clear()
+        header = _padString(address) + _padString(typetags)
+        _headers[key] = header
+    return header
+
+def _plan(typetags):
+    """Splits a typetag signature into runs of fixed size arguments,
+    each packed by one precompiled struct, and strings and blobs
+    which are padded in place. Plans are cached per signature."""
+    plan = _plans.get(typetags)
+    if plan is None:
+        if len(_plans) > _max_cached:
+            _plans.clear()
+        plan = []
+        run = ""
+        for tag in typetags[1:]:
+            if tag == "s" or tag == "b":
+                if run:
+                    plan.append((struct.Struct(">" + run), len(run)))
+                    run = ""
+                plan.append((tag, 1))
+            else:
+                run = run + tag
+        if run:
+            plan.append((struct.Struct(">" + run), len(run)))
+        _plans[typetags] = plan
+    return plan
+
+def encodeOSC(address, msg=()):
+    """Encodes an address and its arguments in one pass.
+
+    Accepts the same arguments as OSCMessage and returns the same
+    binary as OSCMessage(address, msg).getBinary(), encoding stops
+    at the first argument of an unsupported type."""
+    if type(msg) not in (list, tuple):
+        msg = (msg,)
+
+    tags = ","
+    values = []
+    for arg in msg:
+        t = type(arg)
+        if t is float:
+            tags = tags + "f"
+        elif t is int or t is bool:
+            tags = tags + "i"
+        elif t is str:
+            tags = tags + "s"
+        elif t is unicode:
+            arg = str(arg)
+            tags = tags + "s"
+        elif t is Blob:
+            tags = tags + "b"
+        else:
+            break
+        values.append(arg)
+
+    parts = [_header(address, tags)]
+    i = 0
+    for packer, count in _plan(tags):
+        if packer == "s":
+            parts.append(_padString(values[i]))
+        elif packer == "b":
+            parts.append(_int32.pack(len(values[i])))
+            parts.append(values[i] + _blob_padding[len(values[i]) & 3])
+        else:
+            parts.append(packer.pack(*values[i:i+count]))
+        i = i + count
+
+    return "".join(parts)
+
 def parseArgs(args):
     """Given a list of strings, produces a list
     where those strings have been parsed (where
@@ -234,29 +362,60 @@ def parseArgs(args):
         parsed.append(interpretation)
     return parsed
 
-def decodeOSC(data):
-    """Converts a typetagged OSC message to a Python list."""
-    table = {"i":readInt, "f":readFloat, "s":readString, "b":readBlob}
+def _stringAt(data, pos, end):
+    """Reads a null terminated string starting at pos,
+    returning (string, next aligned position)."""
+    length = data.find("\0", pos, end)
+    if length == -1:
+        return (data[pos:end], end)
+    return (data[pos:length], pos + ((length - pos + 4) & ~3))
+
+def _blobAt(data, pos, end):
+    length = _int32.unpack_from(data, pos)[0]
+    start = pos + 4
+    return (data[start:start+length], start + ((length + 3) & ~3))
+
+def _intAt(data, pos, end):
+    if end - pos < 4:
+        print "Error: too few bytes for int", data[pos:end], end - pos
+        return (0, pos)
+    return (_int32.unpack_from(data, pos)[0], pos + 4)
+
+def _floatAt(data, pos, end):
+    if end - pos < 4:
+        print "Error: too few bytes for float", data[pos:end], end - pos
+        return (0, pos)
+    return (_float32.unpack_from(data, pos)[0], pos + 4)
+
+_readers = {"i":_intAt, "f":_floatAt, "s":_stringAt, "b":_blobAt}
+
+def _decodeAt(data, pos, end):
+    """Decodes the message or bundle held in data[pos:end]
+    without copying the remaining buffer for each argument."""
     decoded = []
-    address,  rest = readString(data)
-    typetags = ""
+    address, pos = _stringAt(data, pos, end)
 
     if address == "#bundle":
-        time, rest = readLong(rest)
+        high, low = _timetag.unpack_from(data, pos)
+        pos += 8
         decoded.append(address)
-        decoded.append(time)
-        while len(rest)>0:
-            length, rest = readInt(rest)
-            decoded.append(decodeOSC(rest[:length]))
-            rest = rest[length:]
-
-    elif len(rest)>0:
-        typetags, rest = readString(rest)
+        decoded.append((long(high) << 32) + low)
+        while pos < end:
+            if end - pos < 4:
+                print "Error: too few bytes for bundle element length", end - pos
+                break
+            length = _int32.unpack_from(data, pos)[0]
+            pos += 4
+            decoded.append(_decodeAt(data, pos, min(pos + length, end)))
+            pos += length
+
+    elif pos < end:
+        typetags, pos = _stringAt(data, pos, end)
         decoded.append(address)
         decoded.append(typetags)
-        if(typetags[0] == ","):
+        if typetags[:1] == ",":
             for tag in typetags[1:]:
-                value, rest = table[tag](rest)                
+                value, pos = _readers[tag](data, pos, end)
                 decoded.append(value)
         else:
             print "Oops, typetag lacks the magic ,"
@@ -264,9 +423,12 @@ def decodeOSC(data):
         decoded.append(address)
         decoded.append(',')
 
-    # return only the data
     return decoded
 
+def decodeOSC(data):
+    """Converts a typetagged OSC message to a Python list."""
+    return _decodeAt(data, 0, len(data))
+
 class NoSuchCallback(Exception):
     pass
 
@@ -279,6 +441,9 @@ class CallbackManager:
 
     def __init__(self):
         self.callbacks = {}
+        self.keyed = {}
+        self.key_functions = {}
+        self.fallbacks = {}
         self.add("#bundle", self.unbundler)
 
     def handle(self, data, source):
@@ -289,10 +454,26 @@ class CallbackManager:
     def dispatch(self, message, source):
         """Sends decoded OSC data to an appropriate calback"""
         address = message[0]
+        found = False
         if address in self.callbacks:
-            for cb in self.callbacks[address]:
+            found = True
+            for cb in tuple(self.callbacks[address]):
                 cb(message, source)
-        else:
+
+        if address in self.key_functions:
+            found = True
+            handlers = self.keyed.get(address)
+            if handlers:
+                cbs = handlers.get(self.key_functions[address](message))
+            else:
+                cbs = None
+            if cbs:
+                for cb in tuple(cbs):
+                    cb(message, source)
+            elif address in self.fallbacks:
+                self.fallbacks[address](message, source)
+
+        if not found:
             raise NoSuchCallback(address)
 
     def add(self, address, callback):
@@ -307,12 +488,59 @@ class CallbackManager:
             else:
                 self.callbacks[address] = [callback]
 
-    def rem(self, callback):
-        """ Remove a callback """
-        for addr, cbs in self.callbacks.iteritems():
-            for c in cbs:
-                if c == callback:
-                    self.callbacks[addr].remove(c)
+    def add_keyed(self, address, key_function, key, callback):
+        """Adds a callback which is only called for messages
+        where key_function(message) == key, so that dispatch
+        cost does not depend on how many keys are registered.
+        A key of None registers the address without indexing
+        the callback."""
+        self.key_functions[address] = key_function
+        if key is not None:
+            self.keyed.setdefault(address, {}).setdefault(key, []).append(callback)
+
+    def set_fallback(self, address, callback):
+        """Sets the callback called for keyed messages whose
+        key has no callbacks, or removes it if callback is None."""
+        if callback == None:
+            self.fallbacks.pop(address, None)
+        else:
+            self.fallbacks[address] = callback
+
+    def rekey(self, address, callback, old_key, new_key):
+        """Moves a keyed callback from old_key to new_key"""
+        if old_key == new_key:
+            return
+        self.rem_keyed(address, old_key, callback)
+        self.add_keyed(address, self.key_functions[address], new_key, callback)
+
+    def rem_keyed(self, address, key, callback):
+        """Removes a keyed callback"""
+        handlers = self.keyed.get(address)
+        if handlers is None or key not in handlers:
+            return
+        cbs = handlers[key]
+        if callback in cbs:
+            cbs.remove(callback)
+        if not cbs:
+            del handlers[key]
+
+    def rem(self, callback, address=None):
+        """ Remove a callback, from address only if given """
+        addresses = [address] if address is not None else self.callbacks.keys()
+        for addr in addresses:
+            cbs = self.callbacks.get(addr)
+            if cbs and callback in cbs:
+                cbs.remove(callback)
+
+    def count(self):
+        """ Number of registered callbacks """
+        total = 0
+        for cbs in self.callbacks.itervalues():
+            total += len(cbs)
+        for handlers in self.keyed.itervalues():
+            for cbs in handlers.itervalues():
+                total += len(cbs)
+        return total
 
 
     def unbundler(self, messages, source):
@@ -400,10 +628,133 @@ if __name__ == "__main__":
     hexDump(bundlebinary)
     print decodeOSC(bundlebinary)
 
+    print "Benchmarking the decoder on a large bundle"
+
+    def sliceDecode(data):
+        """The previous decoder, copying the rest of the buffer per argument."""
+        table = {"i":readInt, "f":readFloat, "s":readString, "b":readBlob}
+        decoded = []
+        address, rest = readString(data)
+        if address == "#bundle":
+            time, rest = readLong(rest)
+            decoded.append(address)
+            decoded.append(time)
+            while len(rest)>0:
+                length, rest = readInt(rest)
+                decoded.append(sliceDecode(rest[:length]))
+                rest = rest[length:]
+        elif len(rest)>0:
+            typetags, rest = readString(rest)
+            decoded.append(address)
+            decoded.append(typetags)
+            for tag in typetags[1:]:
+                value, rest = table[tag](rest)
+                decoded.append(value)
+        else:
+            decoded.append(address)
+            decoded.append(',')
+        return decoded
+
+    large = OSCBundle()
+    for i in range(500):
+        fader = OSCMessage("/live/track/device/param")
+        for arg in (i, 0, 3, "Track %d" % i, "Device", "Param", "-3.2 dB", 0.5, 0.0, 1.0, 0):
+            fader.append(arg)
+        large.append(fader)
+    largebinary = large.getBinary()
+
+    assert decodeOSC(largebinary) == sliceDecode(largebinary)
+    for name, fn in (("slices", sliceDecode), ("cursor", decodeOSC)):
+        start = time.time()
+        for i in range(20):
+            fn(largebinary)
+        print "%s: %.2f ms per %d byte bundle" % (name, (time.time() - start) * 1000 / 20, len(largebinary))
+
+    print "Benchmarking the encoder on a listener payload"
+
+    args = (3, 0, 12, u"Bass", "Operator", "Filter Freq", "2.4 kHz", 0.62, 0.0, 1.0, 0)
+    assert encodeOSC("/live/track/device/param", args) == OSCMessage("/live/track/device/param", args).getBinary()
+    assert encodeOSC("/foo", 4.5) == OSCMessage("/foo", 4.5).getBinary()
+    assert encodeOSC("/foo", (1, None, 2)) == OSCMessage("/foo", (1, None, 2)).getBinary()
+    for name, fn in (("OSCMessage", lambda: OSCMessage("/live/track/device/param", args).getBinary()),
+                     ("encodeOSC", lambda: encodeOSC("/live/track/device/param", args))):
+        start = time.time()
+        for i in range(10000):
+            fn()
+        print "%s: %.2f us per message" % (name, (time.time() - start) * 100)
+
+    def sendChunked(address, args, binaries, max_size=1472):
+        """Bundles encoded messages as OscletonOSC.send_chunked does."""
+        header = len(encodeOSC(address, tuple(args) + (0, 1)))
+        groups = groupForBundles(binaries, max_size - 4 - header) or [[]]
+        return [bundleBinaries([encodeOSC(address, tuple(args) + (index, len(groups)))] + group)
+                for index, group in enumerate(groups)]
+
+    print "Benchmarking a snapshot of a 100 track x 200 scene session"
+
+    # The records OscletonSnapshotComponent sends, with 3 devices per
+    # track and a clip in every third slot. Walking Live isn't included
+    def snapshotRecords(tracks, scenes):
+        records = [("/live/snapshot/song", (120.0, 0, 0, 4, 4, tracks, 4, scenes))]
+        for ty, count in ((0, tracks), (1, 4), (2, 1)):
+            for t in range(count):
+                records.append(("/live/snapshot/track", (ty, t, "Track %d" % t, 1, 0.85, 0.0, 0, 0, 0, 3)))
+                for d in range(3):
+                    records.append(("/live/snapshot/device", (ty, t, d, "Device %d" % d)))
+        for s in range(scenes):
+            records.append(("/live/snapshot/scene", (s, "Scene %d" % s, 2)))
+        for t in range(tracks):
+            clips = [s for s in range(scenes) if (t + s) % 3 == 0]
+            states = "".join([chr(1 if (t + s) % 3 == 0 else 0) for s in range(scenes)])
+            records.append(("/live/snapshot/clips", (t, Blob(states))))
+            for s in clips:
+                records.append(("/live/snapshot/clip", (t, s, "Clip %d %d" % (t, s), 123456)))
+        return records
+
+    start = time.time()
+    records = snapshotRecords(100, 200)
+    binaries = [encodeOSC(address, args) for address, args in records]
+    packets = sendChunked("/live/snapshot/chunk", (7,), binaries)
+    elapsed = time.time() - start
+    received = []
+    for packet in packets:
+        received.extend(decodeOSC(packet)[3:])
+    assert len(received) == len(records) and max(map(len, packets)) <= 1472
+    print "%d records: %d datagrams, %d KB in %.1f ms" % (len(records), len(packets), sum(map(len, packets)) / 1024, elapsed * 1000)
+
+    print "Benchmarking 10000 clip names, in name blocks and per clip"
+
+    # Pages of 32 /live/clip/name/block rows as OscletonMixin.send_pages
+    # sends them, against a request and a reply per clip
+    rows = [(t, s, "Clip %d %d" % (t, s)) for s in range(100) for t in range(100) if (t, s) != (5, 7)]
+    start = time.time()
+    pages = [encodeOSC("/live/clip/name/block", [a for row in rows[i:i + 32] for a in row]) for i in range(0, len(rows), 32)]
+    packets = sendChunked("/live/clip/name/block/page", (0, 0, 100, 100), pages)
+    elapsed = time.time() - start
+    names = []
+    for packet in packets:
+        for m in decodeOSC(packet)[3:]:
+            names.extend([tuple(m[i:i + 3]) for i in range(2, len(m), 3)])
+    assert names == rows and max(map(len, packets)) <= 1472
+    print "block: %d datagrams of at most %d bytes in %.1f ms" % (len(packets), max(map(len, packets)), elapsed * 1000)
+
+    start = time.time()
+    replies = 0
+    for s in range(100):
+        for t in range(100):
+            request = decodeOSC(encodeOSC("/live/clip/name", (t, s)))
+            if (request[2], request[3]) != (5, 7):
+                encodeOSC("/live/clip/name", (request[2], request[3], "Clip %d %d" % (request[2], request[3])))
+                replies += 1
+    elapsed = time.time() - start
+    print "per clip: 10000 requests and %d replies in %.1f ms" % (replies, elapsed * 1000)
+
     print "Testing the callback manager."
     
     c = CallbackManager()
     c.add("/print", printingCallback)
+    c.add("/foo/play", printingCallback)
+    c.add("/foo", printingCallback)
     
     c.handle(message.getBinary(), None)
     
@@ -411,3 +762,63 @@ if __name__ == "__main__":
 
     print "sending a bundle to the callback manager"
     c.handle(bundlebinary, None)
+
+    print "Testing keyed callbacks"
+
+    calls = []
+    def trackKey(msg):
+        return msg[2] if len(msg) >= 3 else None
+    def firstCallback(msg, source):
+        calls.append(("first", msg[2]))
+    def secondCallback(msg, source):
+        calls.append(("second", msg[2]))
+
+    k = CallbackManager()
+    k.add_keyed("/track/mute", trackKey, 0, firstCallback)
+    k.add_keyed("/track/mute", trackKey, 1, secondCallback)
+    for t in range(3):
+        k.dispatch(["/track/mute", ",i", t], None)
+    assert calls == [("first", 0), ("second", 1)]
+
+    del calls[:]
+    k.rekey("/track/mute", firstCallback, 0, 2)
+    for t in range(3):
+        k.dispatch(["/track/mute", ",i", t], None)
+    assert calls == [("second", 1), ("first", 2)]
+
+    del calls[:]
+    k.rem_keyed("/track/mute", 2, firstCallback)
+    for t in range(3):
+        k.dispatch(["/track/mute", ",i", t], None)
+    assert calls == [("second", 1)]
+    assert k.keyed["/track/mute"].keys() == [1]
+    print "ok"
+
+    print "Counting callbacks"
+
+    # The unbundler and the keyed callback left
+    assert k.count() == 2
+    k.add("/tempo", firstCallback)
+    k.add_keyed("/track/mute", trackKey, 3, firstCallback)
+    assert k.count() == 4
+    k.rem(firstCallback, "/tempo")
+    k.rem_keyed("/track/mute", 3, firstCallback)
+    assert k.count() == 2
+    print "ok"
+
+    print "Testing fallbacks"
+
+    def fallbackCallback(msg, source):
+        calls.append(("fallback", msg[2]))
+
+    del calls[:]
+    k.set_fallback("/track/mute", fallbackCallback)
+    for t in range(3):
+        k.dispatch(["/track/mute", ",i", t], None)
+    assert calls == [("fallback", 0), ("second", 1), ("fallback", 2)]
+
+    del calls[:]
+    k.set_fallback("/track/mute", None)
+    k.dispatch(["/track/mute", ",i", 0], None)
+    assert calls == []
+    print "ok"
@@ -8,9 +8,14 @@ from OscletonTransportComponent import OscletonTransportComponent
 from OscletonPreferences import OscletonPreferences
 from OscletonUpdater import OscletonUpdater
 from OscletonBrowserComponent import OscletonBrowserComponent
+from OscletonSnapshotComponent import OscletonSnapshotComponent
+from OscletonDeviceComponent import OscletonDeviceComponent
 
 from OscletonMixin import OscletonMixin
 from OscletonOSC import OscletonOSC
+from OscletonShadow import OscletonShadow
+
+import time
 
 
 class Oscleton(ControlSurface):
@@ -28,7 +33,13 @@ class Oscleton(ControlSurface):
             OscletonMixin.set_log(self.log_message)
             self.osc_handler = OscletonOSC(self)
             OscletonMixin.set_osc_handler(self.osc_handler)
+            OscletonMixin.set_shadow(OscletonShadow(self.osc_handler))
+            self.osc_handler.add_gauge('components', OscletonMixin.registered_components)
+            self.osc_handler.add_gauge('observed_devices', OscletonDeviceComponent.observed_count)
+            self.osc_handler.add_gauge('parameter_listeners', OscletonDeviceComponent.parameter_count)
+            self.osc_handler.add_gauge('pooled', OscletonMixin.pooled_count)
             
+            start = time.time()
             self._app = OscletonApplicationComponent(1, 1)
             self._app.setMidiRemoteScriptVersion(self.midi_remote_script_version)
             self._mixer = OscletonMixerComponent(1)
@@ -38,6 +49,11 @@ class Oscleton(ControlSurface):
             self._prefs = OscletonPreferences()
             self._updater = OscletonUpdater(self._prefs, self.midi_remote_script_version)
             self._browser = OscletonBrowserComponent()
+            self._snapshot = OscletonSnapshotComponent()
+
+            load = time.time() - start
+            self.osc_handler.timing('load', load)
+            self.log_message('Oscleton: loaded in ' + str(int(load * 1000)) + 'ms')
             
             self.parse()
 
@@ -55,14 +71,30 @@ class Oscleton(ControlSurface):
 
 
     def disconnect(self):
-        self.osc_handler.send('/live/quit', True)
+        OscletonMixin.drain_pools()
+        self.osc_handler.flush()
+        self.osc_handler.send('/live/quit', True, True)
         self.osc_handler.shutdown()
 
 
     def parse(self):
+        # Structural changes are handled once per tick: those made in
+        # Live before handling messages, those they caused before sending
+        OscletonDeviceComponent.release_idle()
+        self._reconcile()
         self.osc_handler.process()
+        self._reconcile()
+        self.osc_handler.flush()
         self.schedule_message(1, self.parse)
     
 
+    def _reconcile(self):
+        start = time.time()
+        ran = OscletonMixin.reconcile()
+        if ran:
+            self.osc_handler.count('reconciled', ran)
+            self.osc_handler.timing('reconcile', time.time() - start)
+
+
     def set_linked_device_ip(self, ip):
         self._prefs.set_linked_device_ip(ip)
\ No newline at end of file
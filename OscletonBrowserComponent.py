@@ -268,10 +268,5 @@ class OscletonBrowserComponent(SessionComponent, OscletonMixin):
         self._browser.stop_preview()
 
 
-    def _split_list_into_chunks(self, l, n): 
-        for i in range(0, len(l), n):  
-            yield l[i:i + n]
-
-
     def _remove_prefix(self, text, prefix):
         return text[text.startswith(prefix) and len(prefix):]
\ No newline at end of file
@@ -3,11 +3,13 @@ from _Framework.SubjectSlot import subject_slot
 
 from OscletonDeviceComponent import OscletonDeviceComponent
 from OscletonParameterComponent import OscletonParameterComponent
-from OscletonMixin import OscletonMixin, wrap_init
+from OscletonMixin import OscletonMixin, wrap_init, track_key
 
 import Live
 
 class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
+
+    message_key = staticmethod(track_key)
     
     @wrap_init
     def __init__(self, *a, **kw):
@@ -15,6 +17,7 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
         self._type = None
         self._devices = []
         self._sends = []
+        self._watched = []
         
         super(OscletonChannelStripComponent, self).__init__(*a, **kw)
     
@@ -29,20 +32,20 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
         self.add_mixer_callback('/live/master/volume', 'volume', 1)
         self.add_mixer_callback('/live/master/pan', 'pan', 1)
 
-        self.add_callback('/live/track/stop', self._stop)
+        self.add_callback('/live/track/stop', self._stop, True)
 
         for t in self._track_types:
-            self.add_callback('/live/'+t+'crossfader', self._crossfader)
+            self.add_callback('/live/'+t+'crossfader', self._crossfader, True)
 
         for ty in ['track', 'return']:
-            self.add_simple_callback('/live/'+ty+'/name', '_track', 'name', self._is_track, getattr(self, '_on_track_name_changed'))
-            self.add_simple_callback('/live/'+ty+'/color', '_track', 'color', self._is_track, getattr(self, '_on_track_color_changed'))
+            self.add_simple_callback('/live/'+ty+'/name', '_track', 'name', self._is_track, self._send_track_name, True)
+            self.add_simple_callback('/live/'+ty+'/color', '_track', 'color', self._is_track, getattr(self, '_on_track_color_changed'), True)
                     
-        self.add_callback('/live/track/state', self._track_state)
+        self.add_callback('/live/track/state', self._track_state, True)
         
         for ty in self._track_types:
-            self.add_callback('/live/'+ty+'devices', self._device_list)
-            self.add_callback('/live/'+ty+'select', self._view)
+            self.add_callback('/live/'+ty+'devices', self._device_list, True)
+            self.add_callback('/live/'+ty+'select', self._view, True)
 
 
     def with_track(fn):
@@ -63,7 +66,7 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
 
     def _get_name(self):
         if self._track is not None:
-            return self._track.name
+            return self._shadow.get(self._track, 'name')
         else:
             return ''
 
@@ -76,9 +79,22 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
     
     def disconnect(self):
         OscletonMixin.disconnect(self)
+        self._unwatch()
+        for c in self._devices + self._sends:
+            c.disconnect()
+        self._devices = []
+        self._sends = []
         super(OscletonChannelStripComponent, self).disconnect()
     
     
+    def unbind(self):
+        for c in self._devices + self._sends:
+            c.park()
+        self._devices = []
+        self._sends = []
+        self.set_track(None)
+    
+    
     def _is_track(self, msg):
         if 'return' in msg[0]:
             ty = 1
@@ -92,6 +108,12 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
         # self.log_message(str(msg) + ' ' + str(self._track_id) + ' ' + str(self._type))
         
         return ty == self._type and check_id
+
+
+    def route_key(self):
+        if self._type is None:
+            return None
+        return (self._type, None if self._type == 2 else self._track_id)
                      
                           
     def add_mixer_callback(self, addr, property, mixer = 0):
@@ -108,10 +130,11 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
                         if v is not None:
                             setattr(obj, pr, v)
                         else:
+                            value = ot(self._shadow.query(self._shadow.get, obj, pr))
                             if self._type == 2:
-                                self.send('/live/master/'+property, ot(getattr(obj, pr)))
+                                self.send('/live/master/'+property, value)
                             else:
-                                self.send_default('/live/'+self._track_types[self._type]+property, ot(getattr(obj, pr)))
+                                self.send_default('/live/'+self._track_types[self._type]+property, value)
                     else:
                         # Sends
                         send_id = msg[3]
@@ -119,12 +142,14 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
                         send = self._sends[send_id]
                         send.set_parameter_value(send_value)
 
-        self.add_callback(addr, cb)
+        self.add_callback(addr, cb, True)
                           
 
     def set_track(self, track):
         if self._is_enabled_ovr:
+            self._unwatch()
             self._track_id, self._type = self.track_id_type(track)
+            self.update_route()
             super(OscletonChannelStripComponent, self).set_track(track)
             
             self._on_device_list_changed.subject = track
@@ -134,22 +159,65 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
             m = track.mixer_device if track else None
             self._on_volume_changed.subject = m.volume if track else None
             self._on_panning_changed.subject = m.panning if track else None
+
+            self._watch()
             
             self._lo2__on_sends_changed()
             self._on_device_list_changed()
 
+
+    def _watch(self):
+        """ Mirrors the properties whose listeners read them through the shadow """
+        if self._track != None:
+            m = self._track.mixer_device
+            self._watched = [self._track, m.volume, m.panning]
+            self._shadow.watch(self._track, 'name', 'color')
+            if self._type < 2:
+                self._shadow.watch(self._track, 'mute', 'solo')
+            if self._type == 0 and self._track.can_be_armed:
+                self._shadow.watch(self._track, 'arm')
+            self._shadow.watch(m.volume, 'value')
+            self._shadow.watch(m.panning, 'value')
+
+
+    def _unwatch(self):
+        # The track may have been deleted, what was watched is
+        # forgotten without reading from it
+        if self._shadow:
+            for obj in self._watched:
+                self._shadow.forget(obj)
+        self._watched = []
+
+
+    def update_track_id(self):
+        """ Refreshes the ids after tracks moved, keeping the listeners
+        and device components. Sends the device list if they changed """
+        track_id, type = self.track_id_type(self._track)
+        if (track_id, type) != (self._track_id, self._type):
+            self._track_id, self._type = track_id, type
+            self.update_route()
+            for dc in self._devices:
+                dc.update_track_id()
+            if self._track is not None:
+                self._send_device_list()
+
     
     def _lo2__on_sends_changed(self):
+        self.invalidate_routes()
+        self.defer(self._update_sends)
+
+
+    def _update_sends(self):
         if self._track is not None and self._type != 2:
             diff = len(self._track.mixer_device.sends) - len(self._sends)
             
             if diff > 0:
                 for i in range(diff):
-                    self._sends.append(OscletonParameterComponent(True))
+                    self._sends.append(OscletonParameterComponent.pooled(True))
             
             if diff < 0:
                 for i in range(len(self._sends)-1, len(self._track.mixer_device.sends)-1, -1):
-                    self._sends[i].disconnect()
+                    self._sends[i].park()
                     self._sends.remove(self._sends[i])
             
             for i,s in enumerate(self._sends):
@@ -160,16 +228,21 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
 
     @subject_slot('devices')
     def _on_device_list_changed(self):
+        self.invalidate_routes()
+        self.defer(self._update_devices)
+
+
+    def _update_devices(self):
         if self._track is not None:
             diff = len(self._track.devices) - len(self._devices)
 
             if diff > 0:
                 for i in range(diff):
-                    self._devices.append(OscletonDeviceComponent())
+                    self._devices.append(OscletonDeviceComponent.pooled())
 
             if diff < 0:
                     for i in range(len(self._devices)-1, len(self._track.devices)-1, -1):
-                        self._devices[i].disconnect()
+                        self._devices[i].park()
                         self._devices.remove(self._devices[i])
         
             for i,dc in enumerate(self._devices):
@@ -181,11 +254,11 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
     @subject_slot('value')
     def _on_volume_changed(self):
         self.log_message(str(self._track_id) +  ' ' + str(self._type) + str(self._track) + str(self._track == self.song().master_track))
-        self.send_default('/live/'+self._track_types[self._type]+'volume', self._track.name, self._track.mixer_device.volume.value)
+        self.notify_default('/live/'+self._track_types[self._type]+'volume', self._shadow.get(self._track, 'name'), self._shadow.get(self._track.mixer_device.volume, 'value'))
 
     @subject_slot('value')
     def _on_panning_changed(self):
-        self.send_default('/live/'+self._track_types[self._type]+'panning', self._track.name, self._track.mixer_device.panning.value)
+        self.notify_default('/live/'+self._track_types[self._type]+'panning', self._shadow.get(self._track, 'name'), self._shadow.get(self._track.mixer_device.panning, 'value'))
 
     
 
@@ -193,19 +266,23 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
     # Callbacks
     def _on_mute_changed(self):
         if self._type < 2 and self._type is not None:
-            self.send_default('/live/'+self._track_types[self._type]+'mute', self._track.name, self._track.mute)
+            self.send_default('/live/'+self._track_types[self._type]+'mute', self._shadow.get(self._track, 'name'), self._shadow.get(self._track, 'mute'))
 
     def _on_solo_changed(self):
         if self._type < 2 and self._type is not None:
-            self.send_default('/live/'+self._track_types[self._type]+'solo', self._track.name, self._track.solo)
+            self.send_default('/live/'+self._track_types[self._type]+'solo', self._shadow.get(self._track, 'name'), self._shadow.get(self._track, 'solo'))
 
     def _on_arm_changed(self):
         if self._type == 0 and self._type is not None and self._track.can_be_armed:
-            self.send_default('/live/'+self._track_types[self._type]+'arm', self._track.name, self._track.arm)
+            self.send_default('/live/'+self._track_types[self._type]+'arm', self._shadow.get(self._track, 'name'), self._shadow.get(self._track, 'arm'))
 
     def _on_track_name_changed(self):
+        self.invalidate_routes()
+        self._send_track_name()
+
+    def _send_track_name(self):
         if self._type is not None:
-            self.send_default('/live/'+self._track_types[self._type]+'name', self._track.name)
+            self.send_default('/live/'+self._track_types[self._type]+'name', self._shadow.get(self._track, 'name'))
 
     def _on_cf_assign_changed(self):
         if self._type < 2 and self._type is not None:
@@ -218,7 +295,7 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
 
     @subject_slot('color')
     def _on_track_color_changed(self):
-        self.send_default('/live/'+self._track_types[self._type]+'color', self._track.color)
+        self.send_default('/live/'+self._track_types[self._type]+'color', self._shadow.get(self._track, 'color'))
 
     
     @subject_slot('playing_slot_index')
@@ -230,14 +307,14 @@ class OscletonChannelStripComponent(ChannelStripComponent, OscletonMixin):
     #@with_track
     def _device_list(self, msg, src):
         if self._is_track(msg) and self._track is not None:
-            self._send_device_list()
+            self._shadow.query(self._send_device_list)
 
 
     def _send_device_list(self):
             devices = []
             for i,d in enumerate(self._track.devices):
                 devices.append(i)
-                devices.append(d.name)
+                devices.append(self._shadow.get(d, 'name'))
                
             if self._type == 2:
                 self.send('/live/'+self._track_types[self._type]+'devices', *devices)
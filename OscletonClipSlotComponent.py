@@ -3,11 +3,25 @@ import Live
 from _Framework.ClipSlotComponent import ClipSlotComponent
 from _Framework.SubjectSlot import subject_slot
 
-from OscletonMixin import OscletonMixin, wrap_init
+from OscletonMixin import OscletonMixin, wrap_init, clip_key
+
+
+def slot_state(slot):
+    """ State of a clip slot as sent by /live/clip/state: 0 empty, 1 stopped, 2 playing, 3 triggered """
+    if slot is None or not slot.has_clip:
+        return 0
+    c = slot.clip
+    if c.is_triggered:
+        return 3
+    if c.is_playing:
+        return 2
+    return 1
 
 
 class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
 
+    message_key = staticmethod(clip_key)
+
     def with_clip(fn):
         def wrap(self, *a, **kw):
             if self._clip_slot is not None:
@@ -21,6 +35,7 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
     def __init__(self, tid, sid, *a, **k):
         self._track_id = tid
         self._scene_id = sid
+        self._watched_clip = None
         
         
         super(OscletonClipSlotComponent, self).__init__(*a, **k)
@@ -29,12 +44,12 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
     
         callbacks = {'color': 'color', 'name': 'name', 'warping': 'warping', 'looping': 'looping', 'loopstart': 'loop_start', 'loopend': 'loop_end', 'start': 'start_marker', 'end': 'end_marker', 'loopjump': 'loop_jump'}
         for n,p in callbacks.iteritems():
-            self.add_simple_callback('/live/clip/'+n, '_clip_slot.clip', p, self._is_clip, getattr(self, '_on_clip_'+n+'_changed'))
+            self.add_simple_callback('/live/clip/'+n, '_clip_slot.clip', p, self._is_clip, getattr(self, '_on_clip_'+n+'_changed'), True)
     
-        self.add_callback('/live/clip/play', self._fire)
-        self.add_callback('/live/clip/stop', self._stop)
-        self.add_callback('/live/clip/pitch', self._pitch)
-        self.add_callback('/live/clip/select', self._view)
+        self.add_callback('/live/clip/play', self._fire, True)
+        self.add_callback('/live/clip/stop', self._stop, True)
+        self.add_callback('/live/clip/pitch', self._pitch, True)
+        self.add_callback('/live/clip/select', self._view, True)
 
 
 
@@ -50,13 +65,49 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
         self._on_clip_start_changed.subject = clip
         self._on_clip_end_changed.subject = clip
         self._on_clip_gain_changed.subject = clip
+
+        if self._watched_clip is not None and self._shadow:
+            self._shadow.forget(self._watched_clip)
+        self._watched_clip = clip
+        if clip is not None:
+            self._shadow.watch(clip, 'name', 'color', 'warping', 'looping', 'loop_start', 'loop_end', 'start_marker', 'end_marker', 'gain')
     
     
+    def disconnect(self):
+        OscletonMixin.disconnect(self)
+        if self._watched_clip is not None and self._shadow:
+            self._shadow.forget(self._watched_clip)
+            self._watched_clip = None
+        super(OscletonClipSlotComponent, self).disconnect()
+
+
+    def unbind(self):
+        # Unroute first, the slot doesn't report state without an id
+        self.set_ids(self._track_id, -1)
+        self.set_clip_slot(None)
+
+
+    def unpark(self, tid, sid):
+        self.set_ids(tid, sid)
+
+
     def _is_clip(self, msg):
         if len(msg) >= 4:
             return msg[2] == self._track_id and msg[3] == self._scene_id
 
 
+    def route_key(self):
+        return (self._track_id, self._scene_id) if self._scene_id > -1 else None
+
+
+    def set_ids(self, tid, sid):
+        """ Moves the slot to new ids, keeping its listeners """
+        if (tid, sid) != (self._track_id, self._scene_id):
+            self._track_id = tid
+            self._scene_id = sid
+            self.update_route()
+
+
     # Properties
     @property
     def id(self):
@@ -65,7 +116,7 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
     def _get_name(self):
         if self._clip_slot is not None:
             if self._clip_slot.has_clip:
-                return self._clip_slot.clip.name
+                return self._shadow.get(self._clip_slot.clip, 'name')
             else:
                 return ''
         else:
@@ -108,31 +159,22 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
         if self._scene_id == -1:
             return
         
-        state = int(self._clip_slot.has_clip) if self._clip_slot is not None else 0
-        
-        if self._clip_slot.has_clip:
-            c = self._clip_slot.clip
-            if c.is_playing:
-                state = 2
-            if c.is_triggered:
-                state = 3
-        
-        self.send('/live/clip/state', self._track_id, self._scene_id, state)
+        self.send('/live/clip/state', self._track_id, self._scene_id, slot_state(self._clip_slot))
 
     
     
     def _lo2__on_clip_color_changed(self):
-        self.send_default('/live/clip/color', self._clip_slot.clip.color)
+        self.send_default('/live/clip/color', self._shadow.get(self._clip_slot.clip, 'color'))
     
     
     @subject_slot('name')
     def _on_clip_name_changed(self):
-        self.send_default('/live/clip/name', self._clip_slot.clip.name)
+        self.send_default('/live/clip/name', self._shadow.get(self._clip_slot.clip, 'name'))
 
 
     @subject_slot('warping')
     def _on_clip_warping_changed(self):
-        self.send_default('/live/clip/warping', self._clip_slot.clip.warping)
+        self.send_default('/live/clip/warping', self._shadow.get(self._clip_slot.clip, 'warping'))
 
     @subject_slot('loop_jump')
     def _on_clip_loopjump_changed(self):
@@ -140,27 +182,27 @@ class OscletonClipSlotComponent(ClipSlotComponent, OscletonMixin):
 
     @subject_slot('looping')
     def _on_clip_looping_changed(self):
-        self.send_default('/live/clip/loopstate', self._clip_slot.clip.looping)
+        self.send_default('/live/clip/loopstate', self._shadow.get(self._clip_slot.clip, 'looping'))
 
     @subject_slot('loop_start')
     def _on_clip_loopstart_changed(self):
-        self.send_default('/live/clip/loopstart', self._clip_slot.clip.loop_start)
+        self.notify_default('/live/clip/loopstart', self._shadow.get(self._clip_slot.clip, 'loop_start'))
 
     @subject_slot('loop_end')
     def _on_clip_loopend_changed(self):
-        self.send_default('/live/clip/loopend', self._clip_slot.clip.loop_end)
+        self.notify_default('/live/clip/loopend', self._shadow.get(self._clip_slot.clip, 'loop_end'))
 
     @subject_slot('start_marker')
     def _on_clip_start_changed(self):
-        self.send_default('/live/clip/start', self._clip_slot.clip.start_marker)
+        self.notify_default('/live/clip/start', self._shadow.get(self._clip_slot.clip, 'start_marker'))
 
     @subject_slot('end_marker')
     def _on_clip_end_changed(self):
-        self.send_default('/live/clip/end', self._clip_slot.clip.end_marker)
+        self.notify_default('/live/clip/end', self._shadow.get(self._clip_slot.clip, 'end_marker'))
 
     @subject_slot('gain')
     def _on_clip_gain_changed(self):
-        self.send_default('/live/clip/gain', self._clip_slot.clip.gain)
+        self.send_default('/live/clip/gain', self._shadow.get(self._clip_slot.clip, 'gain'))
     
 
 
@@ -3,22 +3,89 @@ from _Framework.SubjectSlot import subject_slot
 
 
 from OscletonParameterComponent import OscletonParameterComponent
-from OscletonMixin import OscletonMixin
+from OscletonMixin import OscletonMixin, device_key, liveobj_key
+
+import time
+import weakref
 
 
 class OscletonDeviceComponent(DeviceComponent, OscletonMixin):
 
+    message_key = staticmethod(device_key)
+
+    # Seconds parameter listeners are kept after the last
+    # message querying or selecting the device
+    param_idle_timeout = 60
+
+    # device component -> time its parameter listeners expire
+    _observed = weakref.WeakKeyDictionary()
 
     def __init__(self):
+        self._track_id = None
+        self._type = None
+        self._device_id = None
         self._parameters = []
         super(OscletonDeviceComponent, self).__init__()
 
         self.set_default('_track_id', '_device_id')
 
         for ty in self._track_types:
-            self.add_callback('/live/'+ty+'device/range', self._device_range)
-            self.add_callback('/live/'+ty+'device/param', self._device_param)
-            self.add_callback('/live/'+ty+'device/select', self._view)
+            self.add_callback('/live/'+ty+'device/range', self._device_range, True)
+            self.add_callback('/live/'+ty+'device/range/page', self._device_range_page, True)
+            self.add_callback('/live/'+ty+'device/param', self._device_param, True)
+            self.add_callback('/live/'+ty+'device/param/page', self._device_param_page, True)
+            self.add_callback('/live/'+ty+'device/select', self._view, True)
+
+
+    def disconnect(self):
+        OscletonMixin.disconnect(self)
+        self.release()
+        super(OscletonDeviceComponent, self).disconnect()
+
+
+    def observe(self):
+        """ Listens to the parameters until param_idle_timeout after the last call """
+        observed = self in OscletonDeviceComponent._observed
+        OscletonDeviceComponent._observed[self] = time.time() + self.param_idle_timeout
+        if not observed:
+            self._on_parameters_changed()
+
+
+    def release(self):
+        """ Removes the parameter listeners """
+        OscletonDeviceComponent._observed.pop(self, None)
+        for pc in self._parameters:
+            pc.park()
+        self._parameters = []
+
+
+    def unbind(self):
+        self.set_device(None)
+        self._on_device_renamed.subject = None
+        self._on_parameters_changed.subject = None
+        self._track_id = None
+        self._type = None
+        self._device_id = None
+
+
+    @staticmethod
+    def release_idle():
+        """ Releases devices not queried or selected within param_idle_timeout """
+        now = time.time()
+        for dc, expires in OscletonDeviceComponent._observed.items():
+            if expires < now:
+                dc.release()
+
+
+    @staticmethod
+    def observed_count():
+        return len(OscletonDeviceComponent._observed)
+
+
+    @staticmethod
+    def parameter_count():
+        """ Number of parameter value listeners """
+        return sum([len(dc._parameters) for dc in OscletonDeviceComponent._observed.keys()])
 
 
     def _is_device(self, msg):
@@ -35,30 +102,65 @@ class OscletonDeviceComponent(DeviceComponent, OscletonMixin):
         return check_id and self._type == ty and d == self._device_id
 
 
+    def route_key(self):
+        if self._type is None:
+            return None
+        return (self._type, None if self._type == 2 else self._track_id, self._device_id)
+
+
     def set_device(self, device):
         self.log_message('set device')
+        # A deleted device compares equal to None
+        if self._device is not None and (device is None or self._device == None or liveobj_key(device) != liveobj_key(self._device)):
+            self.release()
+            self._shadow.forget(self._device)
         super(OscletonDeviceComponent, self).set_device(device)
 
         if device is not None:
             self._track_id, self._type = self.track_id_type(device.canonical_parent)
             self._device_id = list(device.canonical_parent.devices).index(device)
+            self.update_route()
 
+            self._on_device_renamed.subject = device
             self._on_parameters_changed.subject = device
             self._on_parameters_changed()
+            self._shadow.watch(device, 'name')
+
+
+    def update_track_id(self):
+        """ Refreshes the track id after tracks moved """
+        if self._device is not None:
+            self._track_id, self._type = self.track_id_type(self._device.canonical_parent)
+            self.update_route()
+
+
+    @subject_slot('name')
+    def _on_device_renamed(self):
+        self.invalidate_routes()
+        self._shadow.get(self._device, 'name')
 
 
     @subject_slot('parameters')
     def _on_parameters_changed(self):
+        self.defer(self._update_parameters)
+
+
+    def _update_parameters(self):
         self.log_message('params changed')
-        diff = len(self._device.parameters) - len(self._parameters)
+        if self._device is None:
+            return
+
+        # Only observed devices listen to their parameters
+        count = len(self._device.parameters) if self in OscletonDeviceComponent._observed else 0
+        diff = count - len(self._parameters)
 
         if diff > 0:
             for i in range(diff):
-                self._parameters.append(OscletonParameterComponent())
+                self._parameters.append(OscletonParameterComponent.pooled())
 
         if diff < 0:
-            for i in range(len(self._parameters)-1, len(self._device.parameters)-1, -1):
-                self._parameters[i].disconnect()
+            for i in range(len(self._parameters)-1, count-1, -1):
+                self._parameters[i].park()
                 self._parameters.remove(self._parameters[i])
 
         for i,pc in enumerate(self._parameters):
@@ -76,32 +178,46 @@ class OscletonDeviceComponent(DeviceComponent, OscletonMixin):
                 d = msg[3] if len(msg) >= 4 else None
                 p = msg[4] if len(msg) >= 5 else None
 
-
             if d is not None:
                 if p is not None:
-                    if p < len(self._device.parameters):
-                        prm = self._device.parameters[p]
-                        # type 2 = master track
-                        if self._type == 2:
-                            self.send('/live/'+self._track_types[self._type]+'device/range', self._device_id, p, prm.min, prm.max)
-                        else:
-                            self.send_default('/live/'+self._track_types[self._type]+'device/range', p, prm.min, prm.max)
-
+                    self._shadow.query(self._send_range, p)
                 else:
-                    prms = []
-                    for i,p in enumerate(self._device.parameters):
-                        prms.extend([i,p.min,p.max])
+                    self._shadow.query(self._send_ranges)
+
+
+    def _device_range_page(self, msg, src):
+        """ Gets the ranges of a page of parameters
+            /live/device/range/page (int track, int device, int offset, int count)
+            /live/master/device/range/page (int device, int offset, int count)
+
+          Replies /live/device/range/page like /live/device/range without a parameter """
+        if self._is_device(msg) and self._device is not None:
+            page = self._page(msg)
+            if page is not None:
+                self._shadow.query(self._send_ranges, page[0], page[1], '/page')
+
+
+    def _send_range(self, p):
+        get = self._shadow.get
+        if p < len(self._device.parameters):
+            prm = self._device.parameters[p]
+            # type 2 = master track
+            if self._type == 2:
+                self.send('/live/'+self._track_types[self._type]+'device/range', self._device_id, p, get(prm, 'min'), get(prm, 'max'))
+            else:
+                self.send_default('/live/'+self._track_types[self._type]+'device/range', p, get(prm, 'min'), get(prm, 'max'))
+
 
-                    # type 2 = master track
-                    if self._type == 2:
-                        self.send('/live/'+self._track_types[self._type]+'device/range', self._device_id, *prms)
-                    else:
-                        self.send_default('/live/'+self._track_types[self._type]+'device/range', *prms)
+    def _send_ranges(self, offset=0, count=None, page=''):
+        get = self._shadow.get
+        rows = [[i, get(p, 'min'), get(p, 'max')] for i, p in self._parameter_page(offset, count)]
+        self._send_rows('device/range' + page, rows)
 
 
 
     def _device_param(self, msg, src):
         if self._is_device(msg) and self._device is not None:
+            self.observe()
             if self._type == 2:
                 p = msg[3] if len(msg) >= 4 else None
                 v = msg[4] if len(msg) >= 5 else None
@@ -119,19 +235,57 @@ class OscletonDeviceComponent(DeviceComponent, OscletonMixin):
 
             # If a parameter id wasn't sent, send all the information about available parameters for this device.
             else:
-                prms = []
-                for i,p in enumerate(self._device.parameters):
-                    prms.extend([i,p.name, p.value])
+                self._shadow.query(self._send_params)
 
-                # type 2 = master track
-                if self._type == 2:
-                    self.send('/live/'+self._track_types[self._type]+'device/param', *prms)
-                else:
-                    self.send_default('/live/'+self._track_types[self._type]+'device/param', *prms)
+
+    def _device_param_page(self, msg, src):
+        """ Gets a page of parameters
+            /live/device/param/page (int track, int device, int offset, int count)
+            /live/master/device/param/page (int device, int offset, int count)
+
+          Replies /live/device/param/page like /live/device/param without a parameter """
+        if self._is_device(msg) and self._device is not None:
+            self.observe()
+            page = self._page(msg)
+            if page is not None:
+                self._shadow.query(self._send_params, page[0], page[1], '/page')
+
+
+    def _send_params(self, offset=0, count=None, page=''):
+        get = self._shadow.get
+        rows = [[i, get(p, 'name'), get(p, 'value')] for i, p in self._parameter_page(offset, count)]
+        self._send_rows('device/param' + page, rows)
+
+
+    def _page(self, msg):
+        """ (offset, count) of a page request, None if missing """
+        i = 3 if self._type == 2 else 4
+        if len(msg) < i + 2:
+            return None
+        return max(0, msg[i]), max(0, msg[i+1])
+
+
+    def _parameter_page(self, offset, count):
+        """ (index, parameter) from offset, count parameters or all of them """
+        parameters = list(self._device.parameters)
+        end = len(parameters) if count is None else offset + count
+        return enumerate(parameters[offset:end], offset)
+
+
+    def _send_rows(self, name, rows):
+        """ Sends rows after the ids the device messages carry, split into
+        name/chunk <ids..> <seq> <total> messages if they don't fit a datagram """
+        # type 2 = master track, its param messages have no device id
+        if self._type == 2:
+            prefix = [self._device_id] if name.startswith('device/range') else []
+        else:
+            prefix = [self._track_id, self._device_id]
+        self.send_rows('/live/'+self._track_types[self._type]+name, prefix, rows)
 
 
     def _view(self, msg, src):
         if self._is_device(msg) and self._device is not None:
+            self.observe()
             self.song().view.selected_track = self._device.canonical_parent
             self.song().view.select_device(self._device)
             self.application().view.show_view('Detail/DeviceChain')
@@ -0,0 +1,120 @@
+from OscletonOutbound import family, coalescing_key
+
+from collections import deque, OrderedDict
+from itertools import islice
+import random
+
+
+class OscletonJournal(object):
+    """ Bounded journal of the state changes sent to the client, stamped
+    with increasing versions so that a client coming back can ask for
+    the changes it missed instead of querying everything again """
+
+    # Leading id arguments per address family, for messages without a
+    # coalescing key. Master messages have none, addresses of families
+    # not listed are not state and aren't journaled
+    id_counts = {
+        'volume': 1,
+        'panning': 1,
+        'mute': 1,
+        'solo': 1,
+        'arm': 1,
+        'name': 1,
+        'color': 1,
+        'crossfader': 1,
+        'devices': 1,
+        'state': 1,
+        'send': 2,
+        'device/param': 2,
+        'device/range': 2,
+        'scene/name': 1,
+        'scene/color': 1,
+        'scene/state': 1,
+        'clip/state': 2,
+        'clip/name': 2,
+        'clip/color': 2,
+        'clip/warping': 2,
+        'clip/loopstate': 2,
+        'clip/loopstart': 2,
+        'clip/loopend': 2,
+        'clip/start': 2,
+        'clip/end': 2,
+        'clip/gain': 2,
+        'clip/pitch': 2,
+        'tempo': 0,
+        'play': 0,
+        'metronome': 0,
+        'signature': 0,
+        'loop': 0,
+        'overdub': 0,
+        'tracks': 0,
+        'scenes': 0,
+        'select': 0,
+        'scene/select': 0,
+    }
+
+    def __init__(self, size=4096):
+        self._entries = deque(maxlen=size)
+        self._version = 0
+        self._id_counts = {}
+
+        # Versions restart with every script instance, the epoch tells
+        # a client coming back whether its version is from this one
+        self._epoch = random.randint(1, 0x7fffffff)
+
+
+    def version(self):
+        """ Version of the last recorded change """
+        return self._version
+
+
+    def epoch(self):
+        """ Id of this journal, sent along with versions """
+        return self._epoch
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def key(self, address, msg, notification=False):
+        """ (address, ids) of the state a message sets, None if it isn't state """
+        key = coalescing_key(address, msg) if notification else None
+        if key is not None:
+            return key
+
+        n = self._id_counts.get(address, -1)
+        if n == -1:
+            n = self.id_counts.get(family(address))
+            if n is not None and address.startswith('/live/master/'):
+                n = 0
+            self._id_counts[address] = n
+
+        if n is None or len(msg) < n:
+            return None
+        return (address,) + tuple(msg[:n])
+
+
+    def record(self, address, msg, notification=False):
+        key = self.key(address, msg, notification)
+        if key is not None:
+            self._version += 1
+            self._entries.append((self._version, key, address, msg))
+
+
+    def since(self, version, epoch=None):
+        """ The last (address, msg) per state changed after version, in the
+        order they were last changed. None if the journal no longer goes
+        back to version, or version is from another epoch """
+        if version > self._version or (epoch is not None and epoch != self._epoch):
+            return None
+        if version == self._version:
+            return []
+        if not self._entries or self._entries[0][0] > version + 1:
+            return None
+
+        latest = OrderedDict()
+        for v, key, address, msg in islice(self._entries, version + 1 - self._entries[0][0], None):
+            latest.pop(key, None)
+            latest[key] = (address, msg)
+        return latest.values()
@@ -1,7 +1,10 @@
 from _Framework.MixerComponent import MixerComponent
+from _Framework.SubjectSlot import subject_slot
 
 from OscletonChannelStripComponent import OscletonChannelStripComponent
-from OscletonMixin import OscletonMixin, wrap_init
+from OscletonMixin import OscletonMixin, wrap_init, liveobj_key
+
+import time
 
 class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
@@ -12,10 +15,12 @@ class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
         self.add_callback('/live/track/name/block', self._track_name_block)
 
-        self.add_function_callback('/live/tracks', self._lo2_on_track_list_changed)
+        self.add_function_callback('/live/tracks', self._send_track_count)
         self._selected_strip.set_track(None)
         self._selected_strip.set_is_enabled(False)
 
+        self._on_tracks_changed.subject = self.song()
+
         self._register_timer_callback(self._update_mixer_vols)
 
 
@@ -25,31 +30,58 @@ class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
 
     def _create_strip(self):
-        return OscletonChannelStripComponent()
+        return OscletonChannelStripComponent.pooled()
+
+
+    @subject_slot('tracks')
+    def _on_tracks_changed(self):
+        self.invalidate_track_index()
 
 
     def _reassign_tracks(self):
-        self.log_message('reassigning tracks')
-        diff = len(self.tracks_to_use()) - len(self._channel_strips)
+        # Listeners firing before the reconcile pass read the ids
+        self.invalidate_track_index()
+        self.defer(self._update_tracks)
 
-        if diff > 0:
-            for i in range(diff):
-                self._channel_strips.append(self._create_strip())
 
-        if diff < 0:
-                for i in range(len(self._channel_strips)-1, len(self.tracks_to_use())-1, -1):
-                    self._channel_strips[i].disconnect()
-                    self._channel_strips.remove(self._channel_strips[i])
+    def _update_tracks(self):
+        self.log_message('reassigning tracks')
+        start = time.time()
+        self.invalidate_track_index()
+        tracks = list(self.tracks_to_use())
+
+        # Strips follow their track wherever it moved, only strips
+        # whose track is gone get rebound to the new tracks
+        bound = {}
+        for cs in self._channel_strips:
+            if cs._track is not None:
+                bound.setdefault(liveobj_key(cs._track), cs)
+
+        strips = [bound.pop(liveobj_key(t), None) for t in tracks]
+        kept = set([id(cs) for cs in strips if cs is not None])
+        spare = [cs for cs in self._channel_strips if id(cs) not in kept]
+
+        for i,t in enumerate(tracks):
+            if strips[i] is None:
+                strips[i] = spare.pop(0) if spare else self._create_strip()
+                strips[i].set_track(t)
+            else:
+                strips[i].update_track_id()
 
-        for i,cs in enumerate(self._channel_strips):
-            cs.set_track(self.tracks_to_use()[i])
+        for cs in spare:
+            cs.park()
+        self._channel_strips[:] = strips
 
 
         for i,r in enumerate(self._return_strips):
-            if i < len(self.song().return_tracks):
-                r.set_track(self.song().return_tracks[i])
+            t = self.song().return_tracks[i] if i < len(self.song().return_tracks) else None
+            if t is not None and r._track is not None and liveobj_key(r._track) == liveobj_key(t):
+                r.update_track_id()
             else:
-                r.set_track(None)
+                r.set_track(t)
+
+        if self._osc_handler:
+            self._osc_handler.timing('reassign_tracks', time.time() - start)
 
 
     def _lo2__on_return_tracks_changed(self):
@@ -59,6 +91,10 @@ class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
     # Callbacks
     def _lo2_on_track_list_changed(self):
+        self.defer(self._send_track_count)
+
+
+    def _send_track_count(self):
         if len(self.song().tracks) != self._track_count:
             self.log_message('/live/tracks:' + str(len(self.song().tracks)))
             self.send('/live/tracks', len(self.song().tracks))
@@ -66,6 +102,8 @@ class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
 
     def _lo2_on_selected_track_changed(self):
+        # A new track gets selected before the track list listeners fire
+        self.invalidate_track_index()
         id, type = self.track_id_type(self.song().view.selected_track)
 
         self.send('/live/track/select', type, id)
@@ -74,16 +112,22 @@ class OscletonMixerComponent(MixerComponent, OscletonMixin):
 
     # Track Callbacks
     def _track_name_block(self, msg, src):
-        """
-        Gets block of scene names
-        """
-        b = []
-        for i in range(msg[2], msg[2]+msg[3]):
-            if i < len(self._channel_strips):
-                t = self.channel_strip(i)
-                b.append(i, t.track_name)
-            else:
-                b.append(i, '')
+        """ Gets a block of track names
+            /live/track/name/block (int offset, int count, [int page_size])
+
+          Replies with bundles led by /live/track/name/block/page <offset> <count> <index> <total>
+          holding /live/track/name/block <id> <name> ... messages of at most page_size tracks """
+        if len(msg) < 4:
+            return
+
+        tracks = list(self.song().visible_tracks)
+        offset = max(0, msg[2])
+        page_size = msg[4] if len(msg) >= 5 else self.name_page_size
+        rows = self._shadow.query(self._track_names, tracks, offset, msg[3])
+        self.send_pages('/live/track/name/block', (msg[2], msg[3]), rows, page_size)
+
 
-        self.send('/live/track/name/block', b)
+    def _track_names(self, tracks, offset, count):
+        get = self._shadow.get
+        return [(offset + i, get(t, 'name')) for i, t in enumerate(tracks[offset:offset + max(0, count)])]
 
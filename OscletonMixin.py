@@ -1,7 +1,9 @@
 from _Framework.SubjectSlot import SubjectSlot, CallableSlotMixin
 from _Framework.Util import mixin
 from functools import wraps, partial
+from collections import OrderedDict
 import types
+import weakref
 import OSC
 
 
@@ -22,29 +24,81 @@ def _decorate(fn, child, name):
     return wrap
 
 
+# class -> [(hook name, listener name)], found once per class
+_hooks = {}
+
+def _class_hooks(cls):
+    hooks = _hooks.get(cls)
+    if hooks is None:
+        hooks = _hooks[cls] = [(m, m.replace('_lo2_', '')) for m in dir(cls) if m.startswith('_lo2_')]
+    return hooks
+
+
 def wrap_init(fn):
     def decorate(self, *a, **kw):
         fn(self, *a, **kw)
         
         if not hasattr(self, 'liveosc'):
-            for m in dir(self):
-                if m.startswith('_lo2_'):
-                    method = getattr(self, m.replace('_lo2_', ''))
-                    child = getattr(self, m)
-                    
-                    # If its a subject slot replace the listener
-                    if isinstance(method, SubjectSlot):
-                        method.listener = _decorate(method.listener, child, m)
-                    
-                    # If its a normal method just overwrite it
-                    else:
-                        setattr(self, m.replace('_lo2_', ''), _decorate(method, child, m))
+            for m, name in _class_hooks(type(self)):
+                method = getattr(self, name)
+                child = getattr(self, m)
+                
+                # If its a subject slot replace the listener
+                if isinstance(method, SubjectSlot):
+                    method.listener = _decorate(method.listener, child, m)
+                
+                # If its a normal method just overwrite it
+                else:
+                    setattr(self, name, _decorate(method, child, m))
 
             self.liveosc = True
 
     return decorate
 
 
+def liveobj_key(obj):
+    """ Hashable identity of a Live object, stable across python wrappers """
+    return getattr(obj, '_live_ptr', obj)
+
+
+
+# -----------------------------------------------------------------
+# Message keys used to index keyed callbacks, so that a message
+# only reaches the component it addresses. They must match the
+# route_key() of the components registering for the address.
+def track_key(msg):
+    """ (type, id) of the track addressed by a track, return or master message """
+    if 'master' in msg[0]:
+        return (2, None)
+    if len(msg) < 3:
+        return None
+    return (1 if 'return' in msg[0] else 0, msg[2])
+
+
+def device_key(msg):
+    """ (type, track id, device id) of the device addressed by a device message """
+    if 'master' in msg[0]:
+        return (2, None, msg[2]) if len(msg) >= 3 else None
+    if len(msg) < 4:
+        return None
+    return (1 if 'return' in msg[0] else 0, msg[2], msg[3])
+
+
+def scene_key(msg):
+    """ id of the scene addressed by a scene message """
+    if len(msg) < 3:
+        return None
+    return msg[2]
+
+
+def clip_key(msg):
+    """ (track id, scene id) of the clip slot addressed by a clip message """
+    if len(msg) < 4:
+        return None
+    return (msg[2], msg[3])
+
+
+
 # -----------------------------------------------------------------
 # Various Helpers
 class OscletonMixin:
@@ -53,7 +107,31 @@ class OscletonMixin:
     _default_args = []
     _subject_slots = []
     _is_enabled_ovr = True
-    _registered_callbacks = []
+    _route = None
+    message_key = None
+
+    # component -> [(address, callback, keyed)], weak so that the
+    # registry itself never keeps a component alive
+    _callback_registry = weakref.WeakKeyDictionary()
+
+    # liveobj_key(track) -> (id, type), shared by all components and
+    # rebuilt lazily after invalidate_track_index()
+    _track_index = None
+
+    # Bumped whenever ids or names may have changed, so that
+    # components can cache what they derive from them
+    _structure_version = 0
+
+    # Structural updates waiting for the reconcile pass, in order
+    _pending = OrderedDict()
+
+    # class -> parked components, reused by pooled() instead of
+    # constructing and registering new ones
+    _pools = {}
+    pool_size = 512
+
+    # Rows per message of the name block replies, unless requested
+    name_page_size = 32
     
     @staticmethod
     def set_log(func):
@@ -64,11 +142,22 @@ class OscletonMixin:
     def set_osc_handler(handler):
         OscletonMixin._osc_handler = handler
     
+    @staticmethod
+    def set_shadow(shadow):
+        OscletonMixin._shadow = shadow
+    
     @staticmethod
     def release_attributes():
         OscletonMixin._osc_handler = None
+        OscletonMixin._shadow = None
         OscletonMixin.log_message = None
 
+
+    @staticmethod
+    def registered_components():
+        """ Number of components with registered callbacks """
+        return len(OscletonMixin._callback_registry)
+
     
     
     def set_is_enabled(self, val):
@@ -81,7 +170,70 @@ class OscletonMixin:
     
     def send(self, addr, *msg):
         if self._is_enabled_ovr:
-            self._osc_handler.send(addr, tuple(msg))
+            self._osc_handler.send(addr, msg)
+
+    def notify(self, addr, *msg):
+        """ Send from a listener, coalesced with queued values of the same target """
+        if self._is_enabled_ovr:
+            self._osc_handler.send(addr, msg, notification=True)
+
+    def send_now(self, addr, *msg):
+        """ Send without waiting for the end of the tick """
+        if self._is_enabled_ovr:
+            self._osc_handler.send(addr, msg, True)
+
+    def send_pages(self, address, range, rows, page_size):
+        """ Sends rows, tuples of arguments, now as address messages of at most
+        page_size rows, in bundles fitting the MTU led by
+        address/page <range..> <index> <total>. Returns the number of bundles """
+        if not self._is_enabled_ovr:
+            return 0
+
+        # A page too large for a bundle on its own is halved
+        header = len(OSC.encodeOSC(address + '/page', tuple(range) + (0, 1)))
+        limit = self._osc_handler.max_size() - 24 - header
+        binaries = []
+        page_size = max(1, page_size)
+        pages = list(self._split_list_into_chunks(rows, page_size))
+        pages.reverse()
+        while pages:
+            page = pages.pop()
+            binary = OSC.encodeOSC(address, [a for row in page for a in row])
+            if len(binary) > limit and len(page) > 1:
+                half = len(page) / 2
+                pages.extend([page[half:], page[:half]])
+            else:
+                binaries.append(binary)
+
+        return self._osc_handler.send_chunked(address + '/page', range, binaries)
+
+
+    def send_rows(self, address, prefix, rows):
+        """ Sends address <prefix..> <rows..> when it fits in a datagram, otherwise
+        address/chunk <prefix..> <seq> <total> <rows..> messages of as many rows
+        as fit, rows being lists of arguments. Returns the number of messages """
+        prefix = list(prefix)
+        args = prefix + [a for row in rows for a in row]
+
+        # Bundle header and element size
+        limit = self._osc_handler.max_size() - 20
+        if len(OSC.encodeOSC(address, args)) <= limit or not rows:
+            self.send(address, *args)
+            return 1
+
+        # A row takes less in a chunk than encoded alone without the address
+        header = len(OSC.encodeOSC(address + '/chunk', prefix + [0, 1])) + 4
+        row_size = max([len(OSC.encodeOSC('', list(row))) - 4 for row in rows])
+        chunks = list(self._split_list_into_chunks(rows, max(1, (limit - header) // row_size)))
+        for seq, chunk in enumerate(chunks):
+            self.send(address + '/chunk', *(prefix + [seq, len(chunks)] + [a for row in chunk for a in row]))
+        return len(chunks)
+
+
+    def _split_list_into_chunks(self, l, n):
+        for i in range(0, len(l), n):
+            yield l[i:i + n]
+
 
     def sendb(self, bundle):
         self._osc_handler.send_message(bundle)
@@ -89,16 +241,97 @@ class OscletonMixin:
     
     def disconnect(self):
         self.log_message('Disconnecting instance' + str(self))
-        #for cb in self._registered_callbacks:
-        #    self._osc_handler._callback_manager.rem(cb)
+        self.remove_callbacks()
+        for fn in [fn for fn in OscletonMixin._pending if getattr(fn, 'im_self', None) is self]:
+            del OscletonMixin._pending[fn]
+
+
+    @classmethod
+    def pooled(cls, *a):
+        """ A parked component of this class set up with unpark(*a), or a new one """
+        pool = OscletonMixin._pools.get(cls)
+        if pool:
+            c = pool.pop()
+            c.unpark(*a)
+            if OscletonMixin._osc_handler:
+                OscletonMixin._osc_handler.count('pool_reused')
+            return c
+        return cls(*a)
 
-        # self.log_message(str(self._osc_handler._callback_manager.callbacks))
 
-    def add_callback(self, msg, func):
-        """ Add a callback for an osc message """
+    def park(self):
+        """ Unbinds the component and keeps it, with its callbacks, for pooled() """
+        self.unbind()
+        self.update_route()
+        pool = OscletonMixin._pools.setdefault(type(self), [])
+        if len(pool) < self.pool_size:
+            pool.append(self)
+        else:
+            self.disconnect()
+
+
+    def unbind(self):
+        """ Releases the Live objects this component listens to, leaving it routed nowhere """
+        pass
+
+
+    def unpark(self, *a):
+        """ Sets up a parked component as the constructor would with a """
+        pass
+
+
+    @staticmethod
+    def pooled_count():
+        return sum([len(pool) for pool in OscletonMixin._pools.itervalues()])
+
+
+    @staticmethod
+    def drain_pools():
+        """ Disconnects all parked components """
+        while OscletonMixin._pools:
+            for c in OscletonMixin._pools.popitem()[1]:
+                c.disconnect()
+
+
+    def remove_callbacks(self):
+        """ Remove all callbacks this component registered """
+        registered = OscletonMixin._callback_registry.pop(self, None)
+        if registered and self._osc_handler:
+            manager = self._osc_handler._callback_manager
+            for msg, func, keyed in registered:
+                if keyed:
+                    manager.rem_keyed(msg, self._route, func)
+                else:
+                    manager.rem(func, msg)
+
+    def add_callback(self, msg, func, keyed=False):
+        """ Add a callback for an osc message
+
+          If keyed the callback is only called for messages whose
+          message_key matches this component's route_key
+        """
         if self._osc_handler:
-            self._osc_handler._callback_manager.add(msg, func)
-            self._registered_callbacks.append(func)
+            if keyed:
+                self.update_route()
+                self._osc_handler._callback_manager.add_keyed(msg, self.message_key, self._route, func)
+            else:
+                self._osc_handler._callback_manager.add(msg, func)
+            OscletonMixin._callback_registry.setdefault(self, []).append((msg, func, keyed))
+
+
+    def route_key(self):
+        """ Key of the messages this component handles, None for none """
+        return None
+
+
+    def update_route(self):
+        """ Moves keyed callbacks to the current route key, call whenever ids change """
+        key = self.route_key()
+        if key != self._route:
+            for msg, func, keyed in OscletonMixin._callback_registry.get(self, ()):
+                if keyed:
+                    self._osc_handler._callback_manager.rekey(msg, func, self._route, key)
+            self._route = key
     
 
     def add_default_callback(self, addr, subject, property, type):
@@ -110,7 +343,7 @@ class OscletonMixin:
             if self.has_arg(msg):
                 setattr(subject, property, msg[2])
             else:
-                self.send(addr, type(getattr(subject, property)))
+                self.send(addr, type(self._shadow.query(self._shadow.get, subject, property)))
     
         self.add_callback(addr, cb)
 
@@ -125,17 +358,17 @@ class OscletonMixin:
         self.add_callback(addr, cb)
     
     
-    def add_simple_callback(self, addr, obj, property, check, fn):
+    def add_simple_callback(self, addr, obj, property, check, fn, keyed=False):
         """ Add a simple setter / getter callback based on default args """
         
         def cb(msg, src):
             if check(msg):
                 if len(msg) == len(self._default_args) + 2 or (len(msg) == len(self._default_args) + 3 and msg[-1] == 'query'):
-                    fn()
+                    self._shadow.query(fn)
                 else:
                     setattr(self._get_object(obj), property, msg[len(self._default_args) + 2])
                             
-        self.add_callback(addr, cb)
+        self.add_callback(addr, cb, keyed)
     
                             
     def _get_object(self, obj):
@@ -159,6 +392,13 @@ class OscletonMixin:
             args.append(getattr(self, a))
         args.extend(ar)
         self.send(addr, *args)
+
+    def notify_default(self, addr, *ar):
+        args = []
+        for a in self._default_args:
+            args.append(getattr(self, a))
+        args.extend(ar)
+        self.notify(addr, *args)
     
 
     def add_listener(self, addr, property, obj, value, *a):
@@ -182,8 +422,67 @@ class OscletonMixin:
             setattr(self, '_on_'+property+'_changed', fn)
     
     
+    @staticmethod
+    def invalidate_track_index():
+        """ Call when the visible, return or master tracks change """
+        OscletonMixin._track_index = None
+        OscletonMixin._structure_version += 1
+
+
+    @staticmethod
+    def invalidate_routes():
+        """ Call when devices, sends or names change """
+        OscletonMixin._structure_version += 1
+
+
+    def defer(self, fn):
+        """ Calls fn once in the next reconcile pass, however many
+        structural changes ask for it before then """
+        OscletonMixin._pending[fn] = True
+
+
+    @staticmethod
+    def reconcile():
+        """ Runs the deferred structural updates, including those they
+        defer themselves. Returns how many ran """
+        ran = 0
+        while OscletonMixin._pending:
+            fn = OscletonMixin._pending.popitem(last=False)[0]
+            ran += 1
+            try:
+                fn()
+            except Exception, e:
+                OscletonMixin._osc_handler._report_error(e)
+        return ran
+
+
+    def _build_track_index(self):
+        index = {}
+        for i, t in enumerate(self.song().visible_tracks):
+            index[liveobj_key(t)] = (i, 0)
+        for i, t in enumerate(self.song().return_tracks):
+            index.setdefault(liveobj_key(t), (i, 1))
+        index.setdefault(liveobj_key(self.song().master_track), (0, 2))
+        return index
+
+
     def track_id_type(self, t):
-        """ Returns the track type and id for a given track """
+        """ Returns the track id and type for a given track """
+        if t is None:
+            return None, None
+
+        index = OscletonMixin._track_index
+        if index is None:
+            index = OscletonMixin._track_index = self._build_track_index()
+
+        try:
+            return index[liveobj_key(t)]
+        except (KeyError, TypeError):
+            return self._find_track_id_type(t)
+
+
+    def _find_track_id_type(self, t):
+        """ Searches the track lists, for tracks missing from the index """
         
         if t in self.song().visible_tracks:
             id = list(self.song().visible_tracks).index(t)
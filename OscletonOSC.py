@@ -1,9 +1,14 @@
 import OSC
+from OscletonOutbound import OscletonOutbound
+from OscletonJournal import OscletonJournal
 import socket
 import sys
 import errno
+import time
 import traceback
 
+from collections import deque
+
 class OscletonOSC(object):
 
     @staticmethod
@@ -21,7 +26,26 @@ class OscletonOSC(object):
 
     _in_error = False
 
-    def __init__(self, oscleton, remotehost = '192.168.0.1', remoteport=9001, localhost='', localport=9000):
+    # Setters where only the last value received in a tick matters:
+    # address -> (message length of the setter, indices of the target ids).
+    # Shorter messages, and those ending with 'query', are queries.
+    coalesced_setters = {
+        '/live/track/volume': (4, (2,)),
+        '/live/return/volume': (4, (2,)),
+        '/live/master/volume': (4, ()),
+        '/live/track/panning': (4, (2,)),
+        '/live/return/panning': (4, (2,)),
+        '/live/master/pan': (4, ()),
+        '/live/track/send': (5, (2, 3)),
+        '/live/return/send': (5, (2, 3)),
+        '/live/master/crossfader': (3, ()),
+        '/live/track/device/param': (6, (2, 3, 4)),
+        '/live/return/device/param': (6, (2, 3, 4)),
+        '/live/master/device/param': (5, (2, 3)),
+        '/live/tempo': (3, ()),
+    }
+
+    def __init__(self, oscleton, remotehost = '192.168.0.1', remoteport=9001, localhost='', localport=9000, mtu=1500, tick_budget=0.01, tick_messages=256, max_backlog=4096, journal_size=4096):
 
         self.oscleton = oscleton
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -39,52 +63,371 @@ class OscletonOSC(object):
             self.show_message(msg)
             self.log_message(msg)
 
+        self._metrics = {}
+        self._gauges = {}
+
+        self._bundling = True
+        self._handling = False
+        self._capture = None
+
+        # Seconds and messages processed per tick, received datagrams
+        # beyond them wait in the backlog
+        self._tick_budget = tick_budget
+        self._tick_messages = tick_messages
+        self._max_backlog = max_backlog
+        self._backlog = deque()
+        self._outbound = OscletonOutbound(self._sendto, self.count, mtu)
+        self._journal = OscletonJournal(journal_size)
+        self._flushed_version = 0
+
         self._callback_manager = OSC.CallbackManager()
         self._callback_manager.add('/live/set_peer', self._set_peer)
         self._callback_manager.add('/live/config/discover_ip', self._discover_ip)
+        self._callback_manager.add('/live/metrics', self._send_metrics)
+        self._callback_manager.add('/live/config/mtu', self._mtu)
+        self._callback_manager.add('/live/config/bundling', self._set_bundling)
+        self._callback_manager.add('/live/batch', self._batch)
+        self._callback_manager.add('/live/sync/since', self._sync_since)
+        self._callback_manager.add('/live/sync/version', self._sync_version)
+
+        self.add_gauge('callbacks', self._callback_manager.count)
+        self.add_gauge('backlog', self._backlog.__len__)
+        self.add_gauge('journal', self._journal.__len__)
 
     def error(self):
         return self._in_error
 
 
-    def send(self, address, msg):
-        oscmsg = OSC.OSCMessage(address, msg)
-        self._socket.sendto(oscmsg.getBinary(), self._remote_addr)
+    def send(self, address, msg, immediate=False, notification=False):
+        """ Queues a message until the end of the tick, unless immediate.
+        Notifications of coalesced addresses replace queued values """
+        # Replies to client messages aren't state changes
+        if notification or not self._handling:
+            self._journal.record(address, msg, notification)
+        if self._capture is not None:
+            self._capture.append((address, msg))
+        elif immediate or not self._bundling:
+            self._sendto(OSC.encodeOSC(address, msg))
+        else:
+            self._outbound.queue(address, msg, not self._handling, notification)
 
     def send_message(self, message):
-        self._socket.sendto(message.getBinary(), self._remote_addr)
+        self._sendto(message.getBinary())
+
+
+    def flush(self):
+        """ Sends the messages queued during this tick as bundles, followed
+        by /live/sync/version if the state changed """
+        version = self._journal.version()
+        if version != self._flushed_version:
+            self._flushed_version = version
+            self.send('/live/sync/version', (version, self._journal.epoch()))
+        self._outbound.flush()
+
+
+    def version(self):
+        """ Version of the last state change sent """
+        return self._journal.version()
+
+    def epoch(self):
+        """ Epoch the versions belong to """
+        return self._journal.epoch()
+
+
+    def _sendto(self, binary):
+        try:
+            self._socket.sendto(binary, self._remote_addr)
+        except socket.error, e:
+            self.count('send_errors')
+            self.log_message('Oscleton: error sending to ' + str(self._remote_addr) + ': ' + str(e))
     
     
     def process(self):
-        try:
-            while 1:
-                self._data, self._addr = self._socket.recvfrom(65536)
+        """ Handles received messages within this tick's time and message
+        budget, leaving the rest in the backlog for the next ticks """
+        start = time.time()
+        deadline = start + self._tick_budget
 
-                try:
-                    self._callback_manager.handle(self._data, self._addr)
+        # Leave at least half of the budget to handling a flood
+        if self._receive(start + self._tick_budget / 2):
+            self._coalesce_setters()
 
-                except OSC.NoSuchCallback, e:
-                    errmsg = 'Unknown callback: '+str(e.args[0])
-                    self.log_message('Oscleton: '+errmsg)
-                    self.send('/live/error', errmsg)
+        handled = 0
+        while self._backlog and handled < self._tick_messages and (handled == 0 or time.time() < deadline):
+            message, addr = self._backlog.popleft()
+            self._handle(message, addr)
+            handled += 1
 
-                except Exception, e:
-                    errmsg = type(e).__name__+': '+str(e.args[0])
-                    tb = sys.exc_info()
-                    stack = traceback.extract_tb(tb[2])
+        self.timing('tick', time.time() - start)
+        if handled:
+            self.count('handled', handled)
 
-                    self.log_message('Oscleton: error handling message ' + errmsg)
-                    self.send('/live/error', errmsg)
-                    self.log_message("".join(traceback.format_list(stack)))
+
+    def _receive(self, deadline):
+        """ Reads and decodes pending datagrams into the backlog until it's
+        full, bundles are split into their messages. Returns the number of
+        datagrams read """
+        received = 0
+        try:
+            while len(self._backlog) < self._max_backlog and time.time() < deadline:
+                data, addr = self._socket.recvfrom(65536)
+                received += 1
+                try:
+                    self._append_message(OSC.decodeOSC(data), addr)
+                except Exception, e:
+                    self._report_error(e)
 
         except socket.error, e:
-            if e.errno == errno.EAGAIN:
+            if e.errno != errno.EAGAIN:
+                self.count('receive_errors')
+
+        except Exception, e:
+            self.log_message('Oscleton: error receiving message '+type(e).__name__+':'+str(e.args[0]))
+
+        if received:
+            self.count('received', received)
+        return received
+
+
+    def _append_message(self, message, addr):
+        if message[0] == '#bundle':
+            # A bundle led by /live/batch <corr> is one batch
+            if len(message) > 2 and message[2][0] == '/live/batch' and len(message[2]) == 3:
+                self._backlog.append((self._batch_message(message[2][2], message[3:]), addr))
                 return
-                self.log_message('Oscleton: Socket unavailable')
+            for m in message[2:]:
+                self._append_message(m, addr)
+        else:
+            self._backlog.append((message, addr))
+
+
+    def _setter_key(self, message):
+        """ Returns (target key, is setter) for coalesced setters, (None, False) otherwise """
+        spec = self.coalesced_setters.get(message[0])
+        if spec is None or (spec[1] and len(message) <= max(spec[1])):
+            return None, False
+        return (message[0],) + tuple([message[i] for i in spec[1]]), len(message) == spec[0] and message[-1] != 'query'
+
+
+    def _coalesce_setters(self):
+        """ Drops setters in the backlog superseded by a later setter for the
+        same target, unless a query for that target comes in between """
+        kept = []
+        superseded = set()
+        for item in reversed(self._backlog):
+            key, setter = self._setter_key(item[0])
+            if key is not None:
+                if not setter:
+                    superseded.discard(key)
+                elif key in superseded:
+                    continue
+                else:
+                    superseded.add(key)
+            kept.append(item)
+
+        dropped = len(self._backlog) - len(kept)
+        if dropped:
+            kept.reverse()
+            self._backlog.clear()
+            self._backlog.extend(kept)
+            self.count('inbound_coalesced', dropped)
+
+
+    def _handle(self, message, addr):
+        try:
+            # Replies to the client aren't rate limited or journaled
+            self._handling = True
+            self._callback_manager.dispatch(message, addr)
 
         except Exception, e:
-            self.log_message('Oscleton: error handling message '+type(e).__name__+':'+str(e.args[0]))
+            self._report_error(e)
+
+        finally:
+            self._handling = False
+
+
+    def _batch_message(self, corr, messages):
+        """ Flattens the messages of a batch bundle into a /live/batch message """
+        batch = ['/live/batch', ',', corr]
+        for m in messages:
+            if m[0] != '#bundle':
+                batch.extend([m[0], len(m) - 2])
+                batch.extend(m[2:])
+        return batch
+
+
+    def _batch(self, msg, source):
+        """ /live/batch <corr> (<address> <argc> <args>...)...
+
+          Handles the sub-commands in order and replies with bundles
+          led by /live/batch <corr> <index> <total>, holding the
+          messages sent while handling them
+        """
+        corr = msg[2]
+        commands = []
+        try:
+            self._parse_batch(msg, commands)
+        except ValueError, e:
+            # The rest of the batch is dropped, the commands before run
+            self._report_error(e)
+
+        capture = self._capture
+        self._capture = []
+        try:
+            for command in commands:
+                try:
+                    self._callback_manager.dispatch(command, source)
+                except Exception, e:
+                    self._report_error(e)
+            replies = self._capture
+        finally:
+            self._capture = capture
+
+        self.count('batches')
+        self.send_chunked('/live/batch', (corr,), [OSC.encodeOSC(address, m) for address, m in replies])
+
+
+    def _parse_batch(self, msg, commands):
+        """ Appends the sub-commands of a batch to commands, raises
+        ValueError at an argument count the batch doesn't hold """
+        i = 3
+        while i + 1 < len(msg):
+            address, argc = msg[i], msg[i + 1]
+            if type(argc) not in (int, long) or not 0 <= argc <= len(msg) - i - 2:
+                raise ValueError('Malformed batch, ' + repr(argc) + ' arguments for ' + str(address))
+            args = list(msg[i + 2:i + 2 + argc])
+            commands.append([address, self._typetags(args)] + args)
+            i += 2 + argc
+
+
+    def send_chunked(self, address, args, binaries):
+        """ Sends encoded messages now, in bundles fitting the MTU, each led
+        by address <args> <index> <total>. Returns the number of bundles """
+        # Header size doesn't depend on the index and total
+        header = len(OSC.encodeOSC(address, tuple(args) + (0, 1)))
+        groups = OSC.groupForBundles(binaries, self.max_size() - 4 - header) or [[]]
+        for index, group in enumerate(groups):
+            self._sendto(OSC.bundleBinaries([OSC.encodeOSC(address, tuple(args) + (index, len(groups)))] + group))
+        self.count('datagrams', len(groups))
+        return len(groups)
+
+
+    def _sync_since(self, msg, source):
+        """ /live/sync/since (int version, [int epoch])
+
+          Replies with the last value of each state changed after version,
+          in bundles led by /live/sync/chunk <version> <index> <total>, then
+          /live/sync/done <version> <changes> <epoch>. If the journal doesn't
+          go back that far, or version is from another epoch, i.e. an earlier
+          script instance, replies /live/sync/snapshot <version> <epoch>, the
+          client has to take a /live/snapshot
+        """
+        version = self._journal.version()
+        epoch = self._journal.epoch()
+        changes = self._journal.since(msg[2] if len(msg) >= 3 else 0, msg[3] if len(msg) >= 4 else None)
+        if changes is None:
+            self.count('sync_overflows')
+            self.send('/live/sync/snapshot', (version, epoch), True)
+        else:
+            if changes:
+                self.send_chunked('/live/sync/chunk', (version,), [OSC.encodeOSC(address, m) for address, m in changes])
+            self.send('/live/sync/done', (version, len(changes), epoch), True)
+
+
+    def _sync_version(self, msg, source):
+        self.send('/live/sync/version', (self._journal.version(), self._journal.epoch()))
+
+
+    def _typetags(self, args):
+        tags = [',']
+        for arg in args:
+            if isinstance(arg, float):
+                tags.append('f')
+            elif isinstance(arg, (int, long)):
+                tags.append('i')
+            else:
+                tags.append('s')
+        return ''.join(tags)
+
+
+    def _report_error(self, e):
+        if isinstance(e, OSC.NoSuchCallback):
+            errmsg = 'Unknown callback: '+str(e.args[0])
+            self.log_message('Oscleton: '+errmsg)
+            self.send('/live/error', errmsg)
+
+        else:
+            errmsg = type(e).__name__+': '+str(e.args[0] if e.args else '')
+            tb = sys.exc_info()
+            stack = traceback.extract_tb(tb[2])
+
+            self.log_message('Oscleton: error handling message ' + errmsg)
+            self.send('/live/error', errmsg)
+            self.log_message("".join(traceback.format_list(stack)))
+
+
+
+    def count(self, name, n=1):
+        """ Increments the named counter reported by /live/metrics """
+        self._metrics[name] = self._metrics.get(name, 0) + n
+
+
+    def timing(self, name, seconds):
+        """ Reports a duration as name_ms, and the longest as name_ms_max """
+        ms = seconds * 1000
+        self._metrics[name + '_ms'] = ms
+        if ms > self._metrics.get(name + '_ms_max', 0):
+            self._metrics[name + '_ms_max'] = ms
+
+
+    def add_gauge(self, name, fn):
+        """ Reports the value of fn() as name in /live/metrics """
+        self._gauges[name] = fn
+
+
+    def metrics(self):
+        values = dict(self._metrics)
+        for name, fn in self._gauges.iteritems():
+            values[name] = fn()
+        return values
+
+
+    def _send_metrics(self, msg, source):
+        args = []
+        for name, value in sorted(self.metrics().iteritems()):
+            args.extend([name, value])
+        self.send('/live/metrics', args)
+
+
+    def set_rate_limit(self, name, hz, deadband=0):
+        """ Limits the address family name (eg. volume, device/param) to hz
+        messages per second per target, dropping float changes below deadband """
+        self._outbound.set_rate_limit(name, hz)
+        self._outbound.set_deadband(name, deadband)
+
+    def rate_limit(self, name):
+        return self._outbound.rate_limit(name), self._outbound.deadband(name)
+
+
+    def max_size(self):
+        """ Largest datagram payload fitting in the MTU """
+        return self._outbound.max_size()
+
+
+    def _mtu(self, msg, source):
+        if len(msg) >= 3:
+            self._outbound.set_mtu(msg[2])
+        else:
+            self.send('/live/config/mtu', self._outbound.mtu())
+
 
+    def _set_bundling(self, msg, source):
+        if len(msg) >= 3:
+            if not msg[2]:
+                self.flush()
+            self._bundling = bool(msg[2])
+        else:
+            self.send('/live/config/bundling', int(self._bundling))
 
 
     def shutdown(self):
@@ -104,7 +447,7 @@ class OscletonOSC(object):
         port = msg[3]
         self.log_message('Oscleton: reconfigured to send to ' + host + ':' + str(port))
         self._remote_addr = (host, port)
-        self.send('/live/set_peer/success', True)
+        self.send('/live/set_peer/success', True, True)
         self.oscleton.set_linked_device_ip(host)
 
 
@@ -119,6 +462,6 @@ class OscletonOSC(object):
 
         self.log_message('Oscleton: IP discovered with success for ' + host + ':' + str(port))
         self._remote_addr = (host, port)
-        self.send('/live/config/discover_ip/success', computer_ip)
+        self.send('/live/config/discover_ip/success', computer_ip, True)
         self.oscleton.set_linked_device_ip(host)
         
\ No newline at end of file
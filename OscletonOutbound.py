@@ -0,0 +1,211 @@
+import OSC
+
+import time
+
+
+def family(address):
+    """ Address without the /live/ and track type prefixes, eg. volume or device/param """
+    address = address[6:] if address.startswith('/live/') else address
+    for ty in ('track/', 'return/', 'master/'):
+        if address.startswith(ty):
+            return address[len(ty):]
+    return address
+
+
+def coalescing_key(address, msg):
+    """ (address, ids) of the target of a high rate notification, None for other messages """
+    spec = OscletonOutbound.coalesced.get(address)
+    if spec is None or type(msg) not in (list, tuple) or len(msg) != spec[0]:
+        return None
+    return (address,) + tuple([msg[i] for i in spec[1]])
+
+
+class OscletonOutbound(object):
+    """ Collects the messages sent during a tick and sends them at
+    the end of the tick as bundles sized to fit in one datagram """
+
+    # IPv4 and UDP headers
+    _header_size = 28
+
+    # High rate notifications where only the last value matters:
+    # address -> (argument count, indices of the ids, index of the value).
+    # Only messages sent as notifications, by listeners, are coalesced,
+    # query replies and dumps sent to the same address are not.
+    coalesced = {
+        '/live/track/volume': (3, (0,), 2),
+        '/live/return/volume': (3, (0,), 2),
+        '/live/master/volume': (3, (0,), 2),
+        '/live/track/panning': (3, (0,), 2),
+        '/live/return/panning': (3, (0,), 2),
+        '/live/master/panning': (3, (0,), 2),
+        '/live/track/send': (8, (0, 2), 4),
+        '/live/return/send': (8, (0, 2), 4),
+        '/live/track/device/param': (11, (0, 1, 2), 7),
+        '/live/return/device/param': (11, (0, 1, 2), 7),
+        '/live/master/device/param': (11, (0, 1, 2), 7),
+        '/live/clip/loopstart': (3, (0, 1), 2),
+        '/live/clip/loopend': (3, (0, 1), 2),
+        '/live/clip/start': (3, (0, 1), 2),
+        '/live/clip/end': (3, (0, 1), 2),
+        '/live/tempo': (1, (), 0),
+    }
+
+    # Default maximum rates per address family in Hz
+    rate_limits = {
+        'device/param': 30,
+        'volume': 60,
+        'panning': 60,
+        'send': 60,
+        'clip/loopstart': 10,
+        'clip/loopend': 10,
+    }
+
+    def __init__(self, sendto, count, mtu=1500):
+        self._sendto = sendto
+        self._count = count
+        self._queue = []
+        self._latest = {}
+
+        self._intervals = {}
+        self._deadbands = {}
+        for name, hz in self.rate_limits.iteritems():
+            self.set_rate_limit(name, hz)
+
+        self._last_sent = {}
+        self._last_values = {}
+        self._held = {}
+
+        # Values dropped by a deadband, key -> (tick, address, msg),
+        # sent once they stay unchanged for a tick
+        self._settling = {}
+        self._ticks = 0
+
+        self.set_mtu(mtu)
+
+
+    def set_mtu(self, mtu):
+        self._mtu = mtu
+        self._max_size = mtu - self._header_size
+
+    def mtu(self):
+        return self._mtu
+
+    def max_size(self):
+        """ Largest datagram payload fitting in the MTU """
+        return self._max_size
+
+
+    def set_rate_limit(self, name, hz):
+        """ Limits an address family to hz messages per second per target, 0 for no limit """
+        if hz:
+            self._intervals[name] = 1.0 / hz
+        else:
+            self._intervals.pop(name, None)
+
+    def rate_limit(self, name):
+        interval = self._intervals.get(name)
+        return 1.0 / interval if interval else 0
+
+
+    def set_deadband(self, name, deadband):
+        """ Drops values of an address family changing by less than deadband, 0 to send all.
+        The last value dropped is sent once it stops changing """
+        if deadband:
+            self._deadbands[name] = deadband
+        else:
+            self._deadbands.pop(name, None)
+
+    def deadband(self, name):
+        return self._deadbands.get(name, 0)
+
+
+    def key(self, address, msg):
+        """ Coalescing key of a message, None if every value must be sent """
+        return coalescing_key(address, msg)
+
+
+    def queue(self, address, msg, limited=True, notification=False):
+        """ Queues a message. A notification replaces a queued value for the same target
+
+          Unless limited is False the rate limit and deadband of the
+          address family apply, held values are sent once the rate allows
+        """
+        key = self.key(address, msg) if notification else None
+        if key is not None:
+            index = self._latest.get(key)
+            if index is not None:
+                self._queue[index] = (address, msg)
+                self._count('coalesced')
+                return
+
+            if limited:
+                name = family(address)
+                deadband = self._deadbands.get(name)
+                value = msg[self.coalesced[address][2]]
+                if deadband and type(value) is float:
+                    last = self._last_values.get(key)
+                    if last is not None and abs(value - last) < deadband:
+                        self._settling[key] = (self._ticks, address, msg)
+                        self._count('deadband')
+                        return
+                    self._last_values[key] = value
+                    self._settling.pop(key, None)
+
+                interval = self._intervals.get(name)
+                if interval and time.time() - self._last_sent.get(key, 0) < interval:
+                    self._held[key] = (address, msg)
+                    self._count('rate_limited')
+                    return
+
+            self._latest[key] = len(self._queue)
+            self._held.pop(key, None)
+
+        self._queue.append((address, msg))
+
+
+    def pending(self):
+        return len(self._queue)
+
+
+    def _release_held(self, now):
+        for key, (address, msg) in self._held.items():
+            if now - self._last_sent.get(key, 0) >= self._intervals.get(family(address), 0):
+                del self._held[key]
+                self._latest[key] = len(self._queue)
+                self._queue.append((address, msg))
+
+
+    def _release_settled(self):
+        """ Holds the values dropped by a deadband that didn't change during the last tick """
+        for key, (tick, address, msg) in self._settling.items():
+            if tick < self._ticks:
+                del self._settling[key]
+                self._last_values[key] = msg[self.coalesced[address][2]]
+                self._held[key] = (address, msg)
+
+
+    def flush(self):
+        """ Sends everything queued since the last flush """
+        now = time.time()
+        if self._settling:
+            self._release_settled()
+        self._ticks += 1
+        if self._held:
+            self._release_held(now)
+
+        if not self._queue:
+            return
+
+        for key in self._latest:
+            self._last_sent[key] = now
+
+        queue = self._queue
+        self._queue = []
+        self._latest = {}
+
+        packets = OSC.packBundles([OSC.encodeOSC(address, msg) for address, msg in queue], self._max_size)
+        for packet in packets:
+            self._sendto(packet)
+
+        self._count('messages', len(queue))
+        self._count('datagrams', len(packets))
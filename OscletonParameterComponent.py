@@ -10,48 +10,73 @@ class OscletonParameterComponent(ControlSurfaceComponent, OscletonMixin):
     def __init__(self, send = False):
         self._is_send = send
         self._parameter = None
+        self._route_info = None
+        self._route_version = None
         super(OscletonParameterComponent, self).__init__()
 
 
+    def disconnect(self):
+        OscletonMixin.disconnect(self)
+        self.set_parameter(None)
+        super(OscletonParameterComponent, self).disconnect()
+
+
+    def unbind(self):
+        self.set_parameter(None)
+
+
+    def unpark(self, send = False):
+        self._is_send = send
+
+
     def set_parameter(self, param):
+        if self._parameter is not None and self._shadow:
+            self._shadow.forget(self._parameter)
         self._parameter = param
+        self._route_info = None
         self._on_value_changed.subject = param
+        # Only the value is listened to, names change when macros are
+        # mapped or renamed and are read from Live
+        if param is not None:
+            self._shadow.watch(param, 'value')
 
 
     def set_parameter_value(self, value):
         self._parameter.value = value
+
+
+    def _get_route_info(self):
+        """ Ids and names describing this parameter, cached until the structure changes """
+        if self._route_info is None or self._route_version != OscletonMixin._structure_version:
+            self._route_version = OscletonMixin._structure_version
+            # The device, or the mixer device for sends
+            device = self._parameter.canonical_parent
+            t = device.canonical_parent
+            tid, ty = self.track_id_type(t)
+
+            if self._is_send:
+                s = list(device.sends).index(self._parameter)
+                return_track_name = self.song().return_tracks[s].name
+                self._route_info = (tid, ty, t.name, s, return_track_name)
+            else:
+                d = list(t.devices).index(device)
+                p = list(device.parameters).index(self._parameter)
+                self._route_info = (tid, ty, t.name, d, p, device.name, self._parameter.min, self._parameter.max)
+
+        return self._route_info
     
     
     @subject_slot('value')
     def _on_value_changed(self):
-        t = self._parameter.canonical_parent.canonical_parent
-        tid, ty = self.track_id_type(t)
-        track_name = self._parameter.canonical_parent.canonical_parent.name
-        
+        param_value = self._shadow.get(self._parameter, 'value')
+        display_value = self._parameter.str_for_value(param_value)
+        automation_state = self._parameter.automation_state
+
         if self._is_send:
-            s = list(self._parameter.canonical_parent.sends).index(self._parameter)
-            return_track = self.song().return_tracks[s]
-            return_track_name = return_track.name
-            send_value = self._parameter.value
-            send_display_value = self._parameter.str_for_value(self._parameter.value)
+            tid, ty, track_name, s, return_track_name = self._get_route_info()
             send_state = self._parameter.state
-            automation_state = self._parameter.automation_state
-            self.send('/live/'+self._track_types[ty]+'send', tid, track_name, s, return_track_name, send_value, send_display_value, send_state, automation_state)
+            self.notify('/live/'+self._track_types[ty]+'send', tid, track_name, s, return_track_name, param_value, display_value, send_state, automation_state)
         
         else:
-
-            track_name = self._parameter.canonical_parent.canonical_parent.name
-
-            d = list(self._parameter.canonical_parent.canonical_parent.devices).index(self._parameter.canonical_parent)
-            device_name = self._parameter.canonical_parent.canonical_parent.devices[d].name
-
-            p = list(self._parameter.canonical_parent.parameters).index(self._parameter)
-            
-            param_display_value = self._parameter.str_for_value(self._parameter.value)
-            param_value = self._parameter.value
-            param_min = self._parameter.min
-            param_max = self._parameter.max
-            automation_state = self._parameter.automation_state
-
-            self.send('/live/'+self._track_types[ty]+'device/param', tid, d, p, track_name, device_name, str(self._parameter.name), param_display_value, param_value, param_min, param_max, automation_state)
-            
+            tid, ty, track_name, d, p, device_name, param_min, param_max = self._get_route_info()
+            self.notify('/live/'+self._track_types[ty]+'device/param', tid, d, p, track_name, device_name, str(self._parameter.name), display_value, param_value, param_min, param_max, automation_state)
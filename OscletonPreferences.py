@@ -9,6 +9,7 @@ class OscletonPreferences(OscletonMixin):
 
         self.add_callback('/live/config/app_track', self.set_app_track)
         self.add_callback('/live/config/app_platform', self.set_app_platform)
+        self.add_callback('/live/config/rate_limit', self._rate_limit)
 
         self._oscletonDirPath = os.path.expanduser("~/Documents/Oscleton")
         self._prefsFilePath = self._oscletonDirPath + "/preferences.json"
@@ -25,6 +26,7 @@ class OscletonPreferences(OscletonMixin):
                 prefs['linkedDeviceIPs'] = []
                 prefs['appTrack'] = 'production'
                 prefs['appPlatform'] = 'android'
+                prefs['rateLimits'] = {}
                 json.dump(prefs, json_file, indent=4)
         
         # Add missing default entries to existing file (if needed)
@@ -46,11 +48,20 @@ class OscletonPreferences(OscletonMixin):
             except KeyError:
                 prefs['appPlatform'] = 'android'
 
+            try:
+                rate_limits = prefs['rateLimits']
+            except KeyError:
+                prefs['rateLimits'] = {}
+
             # Write back to file
             jsonFile = open(self._prefsFileFullPath, "w+")
             jsonFile.write(json.dumps(prefs, indent=4))
             jsonFile.close()
 
+            # Apply rate limits overriding the defaults
+            for name, limit in prefs['rateLimits'].iteritems():
+                self._osc_handler.set_rate_limit(str(name), limit[0], limit[1])
+
 
     def set_linked_device_ip(self, ip):
 
@@ -124,4 +135,33 @@ class OscletonPreferences(OscletonMixin):
         with open(self._prefsFilePath) as json_file:
             prefs = json.load(json_file)
             app_track = prefs['appPlatform']
-            return app_track
\ No newline at end of file
+            return app_track
+
+
+    def _rate_limit(self, msg, src):
+        """ /live/config/rate_limit (string family, [float hz, [float deadband]])
+          eg. /live/config/rate_limit 'device/param' 30 0.01
+        """
+        name = msg[2]
+
+        if len(msg) >= 4:
+            hz = msg[3]
+            deadband = msg[4] if len(msg) >= 5 else 0
+            self._osc_handler.set_rate_limit(name, hz, deadband)
+
+            # Open json file for reading
+            jsonFile = open(self._prefsFileFullPath, "r")
+            prefs = json.load(jsonFile)
+            jsonFile.close()
+
+            # Update prefs json
+            prefs['rateLimits'][name] = [hz, deadband]
+
+            # Write back to file
+            jsonFile = open(self._prefsFileFullPath, "w+")
+            jsonFile.write(json.dumps(prefs, indent=4))
+            jsonFile.close()
+
+        else:
+            hz, deadband = self._osc_handler.rate_limit(name)
+            self.send('/live/config/rate_limit', name, float(hz), float(deadband))
@@ -3,13 +3,14 @@ from _Framework.Util import nop
 from _Framework.SubjectSlot import subject_slot
 
 from OscletonClipSlotComponent import OscletonClipSlotComponent
-from OscletonMixin import OscletonMixin, wrap_init
+from OscletonMixin import OscletonMixin, wrap_init, scene_key, liveobj_key
 
 from functools import wraps
 
 class OscletonSceneComponent(SceneComponent, OscletonMixin):
 
     clip_slot_component_type = OscletonClipSlotComponent
+    message_key = staticmethod(scene_key)
     
     def with_id(fn):
         @wraps(fn)
@@ -23,25 +24,74 @@ class OscletonSceneComponent(SceneComponent, OscletonMixin):
     @wrap_init
     def __init__(self, id = -1, *a, **k):
         self._scene = None
+        self._watched_scene = None
         self._scene_id = id
+        self._slot_window = None
         super(OscletonSceneComponent, self).__init__(*a, **k)
 
+        # Slots created by the framework are disconnected with it,
+        # those added in update() are ours to disconnect
+        self._framework_slots = list(self._clip_slots)
+
         self.set_default('_scene_id')
         
         callbacks = {'color': 'color', 'name': 'name'}
         for n,p in callbacks.iteritems():
-            self.add_simple_callback('/live/scene/'+n, '_scene', p, self._is_scene, getattr(self, '_on_scene_'+n+'_changed'))
+            self.add_simple_callback('/live/scene/'+n, '_scene', p, self._is_scene, getattr(self, '_on_scene_'+n+'_changed'), True)
         
-        self.add_callback('/live/scene/play', self._fire)
-        self.add_callback('/live/scene/select', self._view)
+        self.add_callback('/live/scene/play', self._fire, True)
+        self.add_callback('/live/scene/select', self._view, True)
     
     
     
+    def disconnect(self):
+        OscletonMixin.disconnect(self)
+        if self._watched_scene is not None and self._shadow:
+            self._shadow.forget(self._watched_scene)
+            self._watched_scene = None
+        for c in self._clip_slots:
+            if c not in self._framework_slots:
+                c.park()
+        self._clip_slots[:] = [c for c in self._clip_slots if c in self._framework_slots]
+        super(OscletonSceneComponent, self).disconnect()
+
+
+    def _disconnect_slot(self, c):
+        if c in self._framework_slots:
+            # Still owned by the framework, unbind it from its slot
+            # and drop its callbacks
+            c.unbind()
+            OscletonMixin.disconnect(c)
+        else:
+            c.park()
+
+
     def _is_scene(self, msg):
         if len(msg) >= 3:
             return msg[2] == self._scene_id
 
 
+    def route_key(self):
+        return self._scene_id if self._scene_id > -1 else None
+
+
+    def set_scene_id(self, id):
+        """ Moves the scene and its clip slots to a new id, keeping their listeners """
+        if id != self._scene_id:
+            self._scene_id = id
+            self.update_route()
+            for c in self._clip_slots:
+                c.set_ids(c._track_id, id)
+
+
+
+    def set_slot_window(self, window):
+        """ Limits clip slot components to the tracks in (start, stop), None for all """
+        if window != self._slot_window:
+            self._slot_window = window
+            self.update()
+
+
 
     # Properties
     @property
@@ -51,7 +101,7 @@ class OscletonSceneComponent(SceneComponent, OscletonMixin):
 
     def _get_name(self):
         if self._scene is not None:
-            return self._scene.name
+            return self._shadow.get(self._scene, 'name')
         else:
             return ''
 
@@ -64,7 +114,7 @@ class OscletonSceneComponent(SceneComponent, OscletonMixin):
 
     def _get_color(self):
         if self._scene is not None:
-            return self._scene.color
+            return self._shadow.get(self._scene, 'color')
         else:
             return 0
 
@@ -78,43 +128,65 @@ class OscletonSceneComponent(SceneComponent, OscletonMixin):
     
     # Overrides
     def _create_clip_slot(self):
-        return self.clip_slot_component_type(len(self._clip_slots), self._scene_id)
+        return self.clip_slot_component_type.pooled(len(self._clip_slots), self._scene_id)
 
 
     def _lo2_set_scene(self, scene):
         self._on_scene_name_changed.subject = scene
         self._on_scene_color_changed.subject = scene
+
+        if self._watched_scene is not None:
+            self._shadow.forget(self._watched_scene)
+        self._watched_scene = scene
+        self._shadow.watch(scene, 'name', 'color')
     
     
     def update(self):
+        self.defer(self._update_clip_slots)
+
+
+    def _update_clip_slots(self):
         if self._allow_updates:
             if self._scene != None and self.is_enabled():
                 self.log_message('reassigning clips')
-                if self._scene is not None:
-                    diff = len(self._scene.clip_slots) - len(self._clip_slots)
-                    
-                    if diff > 0:
-                        for i in range(diff):
-                            self._clip_slots.append(self._create_clip_slot())
-                    
-                    if diff < 0:
-                        for i in range(len(self._clip_slots)-1, len(self._scene.clip_slots)-1, -1):
-                            self._clip_slots[i].disconnect()
-                            self._clip_slots.remove(self._clip_slots[i])
-                    
-                    for i,c in enumerate(self._clip_slots):
-                        c.set_clip_slot(self._scene.clip_slots[i])
+                slots = list(self._scene.clip_slots)
+                start, stop = self._slot_window or (0, len(slots))
+                start = min(max(start, 0), len(slots))
+                slots = slots[start:stop]
+
+                # Clip slot components follow their slot when tracks
+                # move, only those whose slot is gone get rebound
+                bound = {}
+                for c in self._clip_slots:
+                    if c._clip_slot is not None:
+                        bound.setdefault(liveobj_key(c._clip_slot), c)
+
+                components = [bound.pop(liveobj_key(s), None) for s in slots]
+                kept = set([id(c) for c in components if c is not None])
+                spare = [c for c in self._clip_slots if id(c) not in kept]
+
+                for i,s in enumerate(slots):
+                    if components[i] is None:
+                        components[i] = spare.pop(0) if spare else self._create_clip_slot()
+                        components[i].set_ids(start + i, self._scene_id)
+                        components[i].set_clip_slot(s)
+                    else:
+                        components[i].set_ids(start + i, self._scene_id)
+
+                for c in spare:
+                    self._disconnect_slot(c)
+                self._clip_slots[:] = components
 
 
     
     # Listeners
     @subject_slot('name')
     def _on_scene_name_changed(self):
-        self.send('/live/scene/name', self._scene_id, self._scene.name)
+        self.send('/live/scene/name', self._scene_id, self._shadow.get(self._scene, 'name'))
     
     @subject_slot('color')
     def _on_scene_color_changed(self):
-        self.send_default('/live/scene/color', self._scene.color)
+        self.send_default('/live/scene/color', self._shadow.get(self._scene, 'color'))
 
 
 
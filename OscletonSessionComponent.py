@@ -2,7 +2,12 @@ from _Framework.SessionComponent import SessionComponent
 from _Framework.SceneComponent import SceneComponent
 
 from OscletonSceneComponent import OscletonSceneComponent
-from OscletonMixin import OscletonMixin, wrap_init
+from OscletonClipSlotComponent import OscletonClipSlotComponent, slot_state
+from OscletonMixin import OscletonMixin, wrap_init, liveobj_key
+
+import OSC
+import struct
+import time
 
 class OscletonSessionComponent(SessionComponent, OscletonMixin):
 
@@ -12,6 +17,8 @@ class OscletonSessionComponent(SessionComponent, OscletonMixin):
     def __init__(self, *args, **kwargs):
         self._scene_count = -1
         self._scenes_count = 0
+        self._viewport = None
+        self._probing = False
         super(OscletonSessionComponent, self).__init__(*args, **kwargs)
 
         #self._selected_scene.disconnect()
@@ -23,7 +30,26 @@ class OscletonSessionComponent(SessionComponent, OscletonMixin):
         self.add_callback('/live/scene/name/block', self._scene_name_block)
         self.add_callback('/live/clip/name/block', self._clip_name_block)
 
-        self.add_function_callback('/live/scenes', self._lo2_on_scene_list_changed)
+        self.add_function_callback('/live/scenes', self._send_scene_count)
+        self.add_callback('/live/session/viewport', self._set_viewport)
+        self.add_callback('/live/clip/state/grid', self._clip_state_grid)
+
+        # Answers clip messages for slots without a component
+        self._probe = OscletonClipSlotComponent(-1, -1)
+        for addr, func, keyed in OscletonMixin._callback_registry.get(self._probe, ()):
+            if keyed:
+                self._osc_handler._callback_manager.set_fallback(addr, self._clip_fallback)
+
+        self._osc_handler.add_gauge('clip_slots', self._clip_slot_count)
+
+
+    def disconnect(self):
+        if self._osc_handler:
+            for addr, func, keyed in OscletonMixin._callback_registry.get(self._probe, ()):
+                self._osc_handler._callback_manager.set_fallback(addr, None)
+        self._probe.disconnect()
+        OscletonMixin.disconnect(self)
+        super(OscletonSessionComponent, self).disconnect()
 
     
     
@@ -40,25 +66,69 @@ class OscletonSessionComponent(SessionComponent, OscletonMixin):
     
     
     def _reassign_scenes(self):
+        self.defer(self._update_scenes)
+
+
+    def _update_scenes(self):
         self.log_message('reassigning scenes')
-        diff = len(self.song().scenes) - len(self._scenes)
-        
-        if diff > 0:
-            for i in range(diff):
-                self._scenes.append(self._create_scene())
-        
-        if diff < 0:
-            for i in range(len(self._scenes)-1, len(self.song().scenes)-1, -1):
-                self._scene[i].disconnect()
-                self._scene.remove(self._scene[i])
-        
-        for i,sc in enumerate(self._scenes):
-            sc.set_scene(self.song().scenes[i])
+        start = time.time()
+        scenes = list(self.song().scenes)
+
+        # Scene components follow their scene wherever it moved, only
+        # those whose scene is gone get rebound to the new scenes
+        bound = {}
+        for sc in self._scenes:
+            if sc._scene is not None:
+                bound.setdefault(liveobj_key(sc._scene), sc)
+
+        components = [bound.pop(liveobj_key(s), None) for s in scenes]
+        kept = set([id(sc) for sc in components if sc is not None])
+        spare = [sc for sc in self._scenes if id(sc) not in kept]
+
+        for i,s in enumerate(scenes):
+            if components[i] is None:
+                components[i] = spare.pop(0) if spare else self._create_scene()
+                components[i].set_scene_id(i)
+                components[i].set_scene(s)
+            else:
+                components[i].set_scene_id(i)
+
+        for sc in spare:
+            sc.disconnect()
+        self._scenes[:] = components
+        self._apply_viewport()
+
+        if self._osc_handler:
+            self._osc_handler.timing('reassign_scenes', time.time() - start)
 
     
     
+    def _slot_window(self, scene_id):
+        if self._viewport is None:
+            return None
+        track_offset, scene_offset, width, height = self._viewport
+        if scene_offset <= scene_id < scene_offset + height:
+            return (track_offset, track_offset + width)
+        return (0, 0)
+
+
+    def _apply_viewport(self):
+        for i,sc in enumerate(self._scenes):
+            sc.set_slot_window(self._slot_window(i))
+
+
+    def _clip_slot_count(self):
+        """ Number of clip slot components listening to Live """
+        return sum([len(sc._clip_slots) for sc in self._scenes])
+
+
+
     # Listeners
     def _lo2_on_scene_list_changed(self):
+        self.defer(self._send_scene_count)
+
+
+    def _send_scene_count(self):
         if len(self.song().scenes) != self._scenes_count:
             self.send('/live/scenes', len(self.song().scenes))
             self._scenes_count = len(self.song().scenes)
@@ -70,19 +140,106 @@ class OscletonSessionComponent(SessionComponent, OscletonMixin):
 
 
 
+    # Session Callbacks
+    def _set_viewport(self, msg, src):
+        """ Limits clip slot listeners to a window of the session, slots
+        outside of it are answered on demand
+            /live/session/viewport (int track_offset, int scene_offset, int width, int height)
+            width or height 0 listens to all slots again """
+        if len(msg) >= 6:
+            viewport = tuple(msg[2:6])
+            self._viewport = viewport if viewport[2] > 0 and viewport[3] > 0 else None
+            self._apply_viewport()
+        else:
+            self.send('/live/session/viewport', *(self._viewport or (0, 0, 0, 0)))
+
+
+    def _clip_fallback(self, msg, src):
+        """ Binds the probe to the addressed slot for one message """
+        if self._probing or len(msg) < 4:
+            return
+
+        tid, sid = msg[2], msg[3]
+        scenes = self.song().scenes
+        if not isinstance(tid, int) or not isinstance(sid, int) or not 0 <= sid < len(scenes):
+            return
+        slots = scenes[sid].clip_slots
+        if not 0 <= tid < len(slots):
+            return
+
+        self._probing = True
+        try:
+            self._probe.set_ids(tid, sid)
+            self._probe.set_clip_slot(slots[tid])
+            self._osc_handler._callback_manager.dispatch(msg, src)
+        finally:
+            # Unroute first, the slot doesn't report state without an id
+            self._probe.set_ids(-1, -1)
+            self._probe.set_clip_slot(None)
+            self._probing = False
+
+
+
+    def _clip_state_grid(self, msg, src):
+        """ Gets the state and color of a block of clip slots
+            /live/clip/state/grid (int track_offset, int scene_offset, int width, int height)
+
+          Replies /live/clip/state/grid <track_offset> <scene_offset> <width> <height>
+          <blob states> <blob colors>, scene by scene a byte per slot as in
+          /live/clip/state and a big endian int32 color per slot, 0 if empty.
+          Blocks larger than a datagram are sent as bands of scenes """
+        if len(msg) < 6:
+            return
+
+        tracks = len(self.song().tracks)
+        scenes = list(self.song().scenes)
+        track_offset = max(0, msg[2])
+        scene_offset = max(0, msg[3])
+        width = max(0, min(msg[4], tracks - track_offset))
+        height = max(0, min(msg[5], len(scenes) - scene_offset))
+
+        # Address, typetags, offsets, sizes and blob lengths take 64 bytes
+        rows = max(1, (self._osc_handler.max_size() - 64) // max(1, width * 5))
+        for offset in range(scene_offset, scene_offset + height, rows):
+            self._shadow.query(self._send_grid, scenes, track_offset, offset, width, min(rows, scene_offset + height - offset))
+
+
+    def _send_grid(self, scenes, track_offset, scene_offset, width, height):
+        get = self._shadow.get
+        states = []
+        colors = []
+        for s in scenes[scene_offset:scene_offset + height]:
+            slots = s.clip_slots
+            for t in range(track_offset, track_offset + width):
+                state = slot_state(slots[t])
+                states.append(chr(state))
+                colors.append(get(slots[t].clip, 'color') if state else 0)
+
+        self.send('/live/clip/state/grid', track_offset, scene_offset, width, height,
+                  OSC.Blob("".join(states)), OSC.Blob(struct.pack('>%di' % len(colors), *colors)))
+
+
+
     # Scene Callbacks
     def _scene_name_block(self, msg, src):
-        """ Gets block of scene names
-        """
-        b = []
-        for i in range(msg[2], msg[2]+msg[3]):
-            if i < len(self._scenes):
-                s = self.scene[i]
-                b.append(i, s.scene_name)
-            else:
-                b.append(i, '')
+        """ Gets a block of scene names
+            /live/scene/name/block (int offset, int count, [int page_size])
+
+          Replies with bundles led by /live/scene/name/block/page <offset> <count> <index> <total>
+          holding /live/scene/name/block <id> <name> ... messages of at most page_size scenes """
+        if len(msg) < 4:
+            return
+
+        scenes = list(self.song().scenes)
+        offset = max(0, msg[2])
+        page_size = msg[4] if len(msg) >= 5 else self.name_page_size
+        rows = self._shadow.query(self._scene_names, scenes, offset, msg[3])
+        self.send_pages('/live/scene/name/block', (msg[2], msg[3]), rows, page_size)
+
 
-        self.send('/live/scene/name/block', b)
+    def _scene_names(self, scenes, offset, count):
+        get = self._shadow.get
+        return [(offset + i, get(s, 'name')) for i, s in enumerate(scenes[offset:offset + max(0, count)])]
     
     
     def _scene_selected(self, msg, src):
@@ -101,22 +258,30 @@ class OscletonSessionComponent(SessionComponent, OscletonMixin):
 
     # Clip Callbacks
     def _clip_name_block(self, msg, src):
-        """ Gets a block of clip names
-        """
-        b = []
-        for i in range(msg[2], msg[2]+msg[3]):
-            if i < len(self._scenes):
-                s = self.scene[i]
-                for j in range(msg[4], msg[4]+msg[5]):
-                    if j < len(s._clip_slots):
-                        c = s.clip_slots(j)
-                        b.append(i, j, c.clip_name)
-                    else:
-                        b.append(i, j, '')
-            else:
-                b.append(i, j, '')
-        
-        self.send('/live/clip/name/block', b)
+        """ Gets the names of the clips in a block of clip slots
+            /live/clip/name/block (int track_offset, int scene_offset, int width, int height, [int page_size])
+
+          Replies with bundles led by /live/clip/name/block/page <track_offset> <scene_offset> <width> <height> <index> <total>
+          holding /live/clip/name/block <track_id> <scene_id> <name> ... messages of at most
+          page_size clips, scene by scene. Slots without a clip are left out """
+        if len(msg) < 6:
+            return
+
+        page_size = msg[6] if len(msg) >= 7 else self.name_page_size
+        rows = self._shadow.query(self._clip_names, max(0, msg[2]), max(0, msg[3]), msg[4], msg[5])
+        self.send_pages('/live/clip/name/block', tuple(msg[2:6]), rows, page_size)
+
+
+    def _clip_names(self, track_offset, scene_offset, width, height):
+        get = self._shadow.get
+        tracks = len(self.song().tracks)
+        rows = []
+        for sid, s in enumerate(list(self.song().scenes)[scene_offset:scene_offset + max(0, height)], scene_offset):
+            slots = s.clip_slots
+            for tid in range(track_offset, min(track_offset + width, tracks)):
+                if slots[tid].has_clip:
+                    rows.append((tid, sid, get(slots[tid].clip, 'name')))
+        return rows
 
     
     
@@ -0,0 +1,94 @@
+from OscletonMixin import liveobj_key
+
+
+# Watched but not read yet
+_unread = object()
+
+
+class OscletonShadow(object):
+    """ Mirror of the Live properties kept current by listeners, so that
+    queries are answered without reading from Live
+
+      Only watched properties are mirrored, and only those a listener
+      reads with get() on every change may be watched. Outside of
+      query() get() always reads from Live, refreshing the mirror
+    """
+
+    # Modes set with /live/config/shadow
+    OFF = 0
+    ON = 1
+    CHECK = 2
+
+    def __init__(self, osc_handler, mode=ON):
+        self._osc_handler = osc_handler
+        self._values = {}
+        self._querying = 0
+        self.mode = mode
+
+        osc_handler._callback_manager.add('/live/config/shadow', self._set_mode)
+        osc_handler.add_gauge('shadowed', self.size)
+
+
+    def watch(self, obj, *properties):
+        """ Mirrors properties of obj """
+        if obj is not None:
+            values = self._values.setdefault(liveobj_key(obj), {})
+            for p in properties:
+                values.setdefault(p, _unread)
+
+
+    def forget(self, obj):
+        """ Stops mirroring obj, call when its listeners are removed """
+        if obj is not None:
+            self._values.pop(liveobj_key(obj), None)
+
+
+    def query(self, fn, *a):
+        """ Calls fn answering get() from the mirror """
+        self._querying += 1
+        try:
+            return fn(*a)
+        finally:
+            self._querying -= 1
+
+
+    def get(self, obj, property):
+        values = self._values.get(liveobj_key(obj)) if obj is not None and self.mode else None
+        if values is None or property not in values:
+            return getattr(obj, property)
+
+        value = values[property]
+        if not self._querying or value is _unread:
+            value = values[property] = getattr(obj, property)
+            if self._querying:
+                self._osc_handler.count('shadow_misses')
+
+        else:
+            self._osc_handler.count('shadow_hits')
+            if self.mode == self.CHECK:
+                live = getattr(obj, property)
+                if live != value:
+                    self._osc_handler.count('shadow_mismatches')
+                    self._osc_handler.log_message('Oscleton: shadow ' + property + ' of ' + str(obj) + ' is ' + str(value) + ', Live has ' + str(live))
+                    value = values[property] = live
+
+        return value
+
+
+    def size(self):
+        """ Number of mirrored properties """
+        return sum([len(values) for values in self._values.itervalues()])
+
+
+    def _set_mode(self, msg, source):
+        """ /live/config/shadow (int mode)
+            0 reads from Live, 1 answers queries from the mirror,
+            2 also compares with Live and counts shadow_mismatches """
+        if len(msg) >= 3:
+            # Listeners don't refresh the mirror while it's off
+            for values in self._values.itervalues():
+                for p in values:
+                    values[p] = _unread
+            self.mode = msg[2]
+        else:
+            self._osc_handler.send('/live/config/shadow', (self.mode,))
@@ -0,0 +1,102 @@
+from _Framework.ControlSurfaceComponent import ControlSurfaceComponent
+
+from OscletonMixin import OscletonMixin
+from OscletonClipSlotComponent import slot_state
+
+import OSC
+import time
+import zlib
+
+
+class OscletonSnapshotComponent(ControlSurfaceComponent, OscletonMixin):
+    """ Sends the whole session in one pass for clients connecting
+
+      /live/snapshot (int id)
+
+      Replies with bundles led by /live/snapshot/chunk <id> <seq> <total>
+      holding the records below, in order, then with
+      /live/snapshot/end <id> <total> <records> <crc32 of the records> <version> <epoch>
+      where version and epoch are to pass to /live/sync/since
+
+        /live/snapshot/song tempo is_playing metronome numerator denominator tracks returns scenes
+        /live/snapshot/track type id name color volume panning mute solo arm devices
+        /live/snapshot/device type track_id device_id name
+        /live/snapshot/scene id name color
+        /live/snapshot/clips track_id (blob state per scene, see /live/clip/state)
+        /live/snapshot/clip track_id scene_id name color, for slots with a clip
+    """
+
+    def __init__(self, *a, **kw):
+        super(OscletonSnapshotComponent, self).__init__(*a, **kw)
+        self._snapshots = 0
+        self.add_callback('/live/snapshot', self._snapshot)
+
+
+    def _snapshot(self, msg, src):
+        start = time.time()
+        self._snapshots += 1
+        snapshot_id = msg[2] if len(msg) >= 3 else self._snapshots
+        version = self._osc_handler.version()
+        epoch = self._osc_handler.epoch()
+
+        records = self._shadow.query(self.records)
+        binaries = [OSC.encodeOSC(address, args) for address, args in records]
+        total = self._osc_handler.send_chunked('/live/snapshot/chunk', (snapshot_id,), binaries)
+        self._osc_handler.send('/live/snapshot/end', (snapshot_id, total, len(binaries), zlib.crc32("".join(binaries)), version, epoch), True)
+
+        self._osc_handler.timing('snapshot', time.time() - start)
+
+
+    def records(self):
+        """ (address, args) of every record of the snapshot """
+        get = self._shadow.get
+        song = self.song()
+        tracks = list(song.visible_tracks)
+        returns = list(song.return_tracks)
+        scenes = list(song.scenes)
+
+        records = [('/live/snapshot/song', (float(get(song, 'tempo')), int(song.is_playing), int(get(song, 'metronome')),
+                                            song.signature_numerator, song.signature_denominator,
+                                            len(tracks), len(returns), len(scenes)))]
+
+        for ty, group in ((0, tracks), (1, returns), (2, [song.master_track])):
+            for i, t in enumerate(group):
+                records.extend(self._track_records(ty, i, t))
+
+        for i, s in enumerate(scenes):
+            records.append(('/live/snapshot/scene', (i, get(s, 'name'), get(s, 'color'))))
+
+        # Clip ids count all tracks, as scene clip slots do
+        for i, t in enumerate(song.tracks):
+            records.extend(self._clip_records(i, t))
+
+        return records
+
+
+    def _track_records(self, ty, tid, t):
+        get = self._shadow.get
+        m = t.mixer_device
+        devices = list(t.devices)
+        mute = int(get(t, 'mute')) if ty < 2 else 0
+        solo = int(get(t, 'solo')) if ty < 2 else 0
+        arm = int(get(t, 'arm')) if ty == 0 and t.can_be_armed else 0
+
+        records = [('/live/snapshot/track', (ty, tid, get(t, 'name'), get(t, 'color'),
+                                             float(get(m.volume, 'value')), float(get(m.panning, 'value')),
+                                             mute, solo, arm, len(devices)))]
+        for did, d in enumerate(devices):
+            records.append(('/live/snapshot/device', (ty, tid, did, get(d, 'name'))))
+        return records
+
+
+    def _clip_records(self, tid, t):
+        get = self._shadow.get
+        states = []
+        clips = []
+        for sid, slot in enumerate(t.clip_slots):
+            state = slot_state(slot)
+            if state:
+                clips.append(('/live/snapshot/clip', (tid, sid, get(slot.clip, 'name'), get(slot.clip, 'color'))))
+            states.append(chr(state))
+
+        return [('/live/snapshot/clips', (tid, OSC.Blob("".join(states))))] + clips
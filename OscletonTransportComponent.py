@@ -17,6 +17,7 @@ class OscletonTransportComponent(TransportComponent, OscletonMixin):
         self._on_playing_changed.subject = s
         self._on_loop_changed.subject = s
         self._on_can_capture_midi_changed.subject = s
+        self._shadow.watch(s, 'tempo', 'metronome')
     
         self.add_default_callback('/live/tempo', s, 'tempo', float)
         self.add_default_callback('/live/time', s, 'current_song_time', float)
@@ -50,7 +51,7 @@ class OscletonTransportComponent(TransportComponent, OscletonMixin):
     # Callbacks
     @subject_slot('metronome')
     def _on_metronome_changed(self):
-        self.send('/live/metronome', int(self.song().metronome))
+        self.send('/live/metronome', int(self._shadow.get(self.song(), 'metronome')))
 
 
     @subject_slot('signature_numerator')
@@ -67,7 +68,7 @@ class OscletonTransportComponent(TransportComponent, OscletonMixin):
                   
     @subject_slot('tempo')
     def _on_tempo_changed(self):
-        self.send('/live/tempo', self.song().tempo)
+        self.notify('/live/tempo', self._shadow.get(self.song(), 'tempo'))
 
 
     @subject_slot('loop')